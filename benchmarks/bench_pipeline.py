@@ -0,0 +1,247 @@
+"""
+End-to-end load test of the download pipeline against a local fake YouTube (fake_ytdlp), so it
+runs offline and needs neither network nor ffmpeg. Each round lists a fresh synthetic playlist
+through /fetch_playlist, downloads all of it through /download while concurrent pollers hit
+/status/<job_id> and /logs, and reports:
+
+  * throughput of download_songs_task (tracks/s from submit to job finished),
+  * /status and /logs latency percentiles under the pollers,
+  * status_lock contention (wait and hold times),
+  * memory growth (RSS and traced Python allocations) from round to round,
+  * retries, throttling backoff and artwork cache activity, when the fake fails downloads
+    transiently (--transient-rate, --throttle-rate) or serves artwork (--thumbnails).
+
+    python benchmarks/bench_pipeline.py --tracks 500 --pollers 8 --rounds 3
+    python benchmarks/bench_pipeline.py --bandwidth-kbps 4096 --failure-rate 0.05 --json results.json
+    python benchmarks/bench_pipeline.py --transient-rate 0.1 --throttle-rate 0.02 --thumbnails 10 --retry-delay 0.2
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# ytmp3_engine opens its caches at import time, so they must point into the scratch directory first
+WORK_DIR = tempfile.mkdtemp(prefix='ytmp3-bench-')
+os.environ['YTMP3_DATA_DIR'] = os.path.join(WORK_DIR, 'data')
+
+import fake_ytdlp
+import ytmp3
+import ytmp3_engine
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def latency_summary(values):
+    return {
+        'requests': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p95_ms': percentile(values, 0.95) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'max_ms': max(values, default=0.0) * 1000,
+    }
+
+
+def histogram_state(histogram):
+    return list(histogram.counts), histogram.count, histogram.sum
+
+
+def histogram_delta(histogram, before):
+    """ Count, mean and approximate p99 (bucket upper bound) of what `histogram` observed since `before`. """
+    counts_before, count_before, sum_before = before
+    counts = [now - then for now, then in zip(histogram.counts, counts_before)]
+    count = histogram.count - count_before
+    p99 = float('inf')
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.buckets, counts):
+        cumulative += bucket_count
+        if count and cumulative >= 0.99 * count:
+            p99 = bound
+            break
+    return {
+        'count': count,
+        'mean_us': (histogram.sum - sum_before) / count * 1e6 if count else 0.0,
+        'p99_us_le': p99 * 1e6 if count else 0.0,
+    }
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def poll(job_id, stop, poll_interval, status_latencies, log_latencies):
+    """ One client polling the way the UI does: incremental /status plus /logs with a cursor. """
+    client = ytmp3.app.test_client()
+    revision = None
+    cursor = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        query = f"?since={revision}" if revision is not None else ''
+        data = client.get(f"/status/{job_id}{query}").get_json()
+        status_latencies.append(time.perf_counter() - started)
+        revision = data.get('revision', revision)
+
+        started = time.perf_counter()
+        cursor = client.get(f"/logs?after={cursor}&job={job_id}").get_json()['cursor']
+        log_latencies.append(time.perf_counter() - started)
+        if poll_interval:
+            stop.wait(poll_interval)
+
+
+def run_round(number, args, backend):
+    client = ytmp3.app.test_client()
+    playlist_url = f"https://www.youtube.com/playlist?list=BENCH{number:03d}"
+    started = time.perf_counter()
+    listing = client.post('/fetch_playlist', json={'url': playlist_url, 'wait': ytmp3_engine.LISTING_WAIT_SECONDS}).get_json()
+    listing_seconds = time.perf_counter() - started
+    if not listing.get('done'):
+        raise RuntimeError(f"Listing did not finish: {listing}")
+
+    lock_wait = histogram_state(ytmp3_engine.status_lock.wait_time)
+    lock_hold = histogram_state(ytmp3_engine.status_lock.hold_time)
+    throttle_events = ytmp3_engine.BACKOFF.events
+    thumbnails = dict(ytmp3_engine.THUMBNAIL_CACHE.stats)
+    started = time.perf_counter()
+    job_id = client.post('/download', json={
+        'songs': listing['songs'], 'playlist_title': listing['playlist_title'],
+        'format': args.format, 'is_playlist': True,
+    }).get_json()['job_id']
+
+    stop = threading.Event()
+    status_latencies = []
+    log_latencies = []
+    pollers = [threading.Thread(target=poll, args=(job_id, stop, args.poll_interval, status_latencies, log_latencies))
+               for _ in range(args.pollers)]
+    for poller in pollers:
+        poller.start()
+    while True:
+        with ytmp3_engine.status_lock:
+            job = ytmp3_engine.JOBS[job_id]
+            if job['status'] in ('finished', 'error'):
+                break
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for poller in pollers:
+        poller.join()
+
+    with ytmp3_engine.status_lock:
+        downloaded, failed = job['downloaded_items'], job['failed_items']
+        retries = sum(item['attempts'] for item in job['results'].values())
+    gc.collect()
+    return {
+        'round': number,
+        'tracks': len(listing['songs']),
+        'downloaded': downloaded,
+        'failed': failed,
+        'listing_seconds': listing_seconds,
+        'download_seconds': elapsed,
+        'tracks_per_second': len(listing['songs']) / elapsed,
+        'mib_per_second': downloaded * backend.track_kb / 1024 / elapsed,
+        'status_latency': latency_summary(status_latencies),
+        'logs_latency': latency_summary(log_latencies),
+        'lock_wait': histogram_delta(ytmp3_engine.status_lock.wait_time, lock_wait),
+        'lock_hold': histogram_delta(ytmp3_engine.status_lock.hold_time, lock_hold),
+        'retries': retries,
+        'throttle_events': ytmp3_engine.BACKOFF.events - throttle_events,
+        'thumbnails': {key: value - thumbnails[key] for key, value in ytmp3_engine.THUMBNAIL_CACHE.stats.items()},
+        'rss_mib': rss_bytes() / 1024 ** 2,
+        'traced_mib': tracemalloc.get_traced_memory()[0] / 1024 ** 2 if tracemalloc.is_tracing() else None,
+    }
+
+
+def print_round(result):
+    print(f"round {result['round']}: {result['downloaded']}/{result['tracks']} downloaded, {result['failed']} failed "
+          f"in {result['download_seconds']:.2f}s ({result['tracks_per_second']:.1f} tracks/s, "
+          f"{result['mib_per_second']:.1f} MiB/s); listing {result['listing_seconds'] * 1000:.0f} ms")
+    for name in ('status_latency', 'logs_latency'):
+        latency = result[name]
+        print(f"  {name:15} {latency['requests']:6d} requests  p50 {latency['p50_ms']:7.2f} ms  "
+              f"p95 {latency['p95_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms  max {latency['max_ms']:7.2f} ms")
+    for name in ('lock_wait', 'lock_hold'):
+        lock = result[name]
+        print(f"  status_{name:8} {lock['count']:8d} acquisitions  mean {lock['mean_us']:8.1f} us  p99 <= {lock['p99_us_le']:.0f} us")
+    thumbnails = result['thumbnails']
+    print(f"  retries: {result['retries']}, throttle events: {result['throttle_events']}; artwork: "
+          f"{thumbnails['hits']} cache hits, {thumbnails['fetches']} fetches, {thumbnails['conversions']} conversions")
+    traced = f", traced {result['traced_mib']:.1f} MiB" if result['traced_mib'] is not None else ''
+    print(f"  memory: RSS {result['rss_mib']:.1f} MiB{traced}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=200, help="tracks per playlist")
+    parser.add_argument('--rounds', type=int, default=3, help="playlists to download, one after another")
+    parser.add_argument('--pollers', type=int, default=8, help="concurrent /status + /logs pollers")
+    parser.add_argument('--poll-interval', type=float, default=0.05, help="seconds between a poller's requests")
+    parser.add_argument('--workers', type=int, default=ytmp3_engine.SETTINGS['workers'])
+    parser.add_argument('--ffmpeg-workers', type=int, default=ytmp3_engine.SETTINGS['ffmpeg_workers'])
+    parser.add_argument('--format', default='mp3')
+    parser.add_argument('--track-kb', type=int, default=256, help="size of each fake track")
+    parser.add_argument('--bandwidth-kbps', type=int, default=0, help="per-download speed of the fake, 0 for unlimited")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds per fake extraction request")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of videos that are unavailable")
+    parser.add_argument('--transient-rate', type=float, default=0.0, help="fraction of download attempts cut off by a network error")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of download attempts answered with HTTP 429")
+    parser.add_argument('--failure-streak', type=int, default=2, help="attempts in a row a transient failure or 429 repeats for")
+    parser.add_argument('--retry-delay', type=float, default=ytmp3_engine.RETRY_BASE_DELAY,
+                        help="seconds before the first retry of a failed download, doubling per attempt")
+    parser.add_argument('--thumbnails', type=int, default=0, help="distinct artwork images the tracks share, 0 for no artwork")
+    parser.add_argument('--postprocess', type=float, default=0.005, help="seconds per fake postprocessor")
+    parser.add_argument('--tracemalloc', action='store_true', help="also trace Python allocations (slows everything down)")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    backend = fake_ytdlp.FakeBackend(
+        tracks=args.tracks, track_kb=args.track_kb, bandwidth_kbps=args.bandwidth_kbps,
+        latency=args.latency, failure_rate=args.failure_rate, transient_rate=args.transient_rate,
+        throttle_rate=args.throttle_rate, failure_streak=args.failure_streak, postprocess_seconds=args.postprocess, thumbnails=args.thumbnails,
+    )
+    fake_ytdlp.install(backend)
+    ytmp3_engine.RETRY_BASE_DELAY = args.retry_delay
+    ytmp3_engine.apply_settings({
+        'workers': args.workers, 'ffmpeg_workers': args.ffmpeg_workers,
+        'requests_per_minute': 0, 'max_download_kbps': 0,
+        'output_dir': os.path.join(WORK_DIR, 'library'), 'scratch_dir': os.path.join(WORK_DIR, 'scratch'),
+    })
+    os.chdir(WORK_DIR)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    results = []
+    try:
+        for number in range(1, args.rounds + 1):
+            result = run_round(number, args, backend)
+            print_round(result)
+            results.append(result)
+    finally:
+        os.chdir(BENCH_DIR)
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    growth = results[-1]['rss_mib'] - results[0]['rss_mib']
+    print(f"RSS growth from round 1 to {len(results)}: {growth:+.1f} MiB; fake requests: {backend.requests}; "
+          f"fake failures: {backend.failures}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'rounds': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Per-track YoutubeDL setup overhead: one instance per song (the old behaviour) versus one
+long-lived instance per worker (WorkerYoutubeDL). Runs offline: only construction, option
+handling and output-template rendering are measured, not network transfers, so the
+connection reuse savings of the pooled variant come on top of these numbers.
+
+    python benchmarks/bench_ydl_reuse.py --tracks 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+import ytmp3_engine
+
+BASE_OPTS = {
+    'writethumbnail': True,
+    'ffmpeg_location': ytmp3_engine.FFMPEG_PATH,
+    'yesplaylist': False,
+    'ignoreerrors': False,
+    'logger': ytmp3_engine.YtdlpLogger(),
+    'retries': 5,
+    'fragment_retries': 5,
+    'quiet': True,
+    'extractor_args': {"youtube": {"player_client": ["default"]}},
+    'format': 'bestaudio/best',
+}
+
+
+def fake_info(index):
+    return {'id': f'video{index:05d}', 'title': f'Track {index}', 'artist': 'Artist', 'ext': 'webm'}
+
+
+def per_song_instances(tracks, folder):
+    for index in range(tracks):
+        def progress_hook(d):
+            pass
+        opts = dict(BASE_OPTS, outtmpl=os.path.join(folder, f"{index + 1:02d} - %(artist)s - %(title)s.%(ext)s"),
+                    progress_hooks=[progress_hook])
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.prepare_filename(fake_info(index))
+
+
+def pooled_instance(tracks, folder):
+    worker_ydl = ytmp3_engine.WorkerYoutubeDL(BASE_OPTS)
+    for index in range(tracks):
+        def progress_hook(d):
+            pass
+        with worker_ydl.song(f'video{index:05d}', progress_hook) as ydl:
+            ydl.params['outtmpl']['default'] = os.path.join(folder, f"{index + 1:02d} - %(artist)s - %(title)s.%(ext)s")
+            ydl.prepare_filename(fake_info(index))
+    worker_ydl.ydl.close()
+
+
+def measure(func, tracks, folder):
+    start = time.perf_counter()
+    func(tracks, folder)
+    return (time.perf_counter() - start) / tracks * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=200)
+    args = parser.parse_args()
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out')
+
+    # Warm up imports and lazy extractor loading so both variants start equal
+    measure(pooled_instance, 5, folder)
+
+    before = measure(per_song_instances, args.tracks, folder)
+    after = measure(pooled_instance, args.tracks, folder)
+    print(f"tracks:                {args.tracks}")
+    print(f"new YoutubeDL per song: {before:8.3f} ms/track")
+    print(f"pooled per worker:      {after:8.3f} ms/track")
+    print(f"saved:                  {before - after:8.3f} ms/track ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
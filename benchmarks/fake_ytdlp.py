@@ -0,0 +1,271 @@
+"""
+A local stand-in for yt_dlp.YoutubeDL, so the download pipeline can be exercised offline.
+
+FakeYoutubeDL serves synthetic playlists and videos from a FakeBackend, which sets the playlist
+size, track size, bandwidth, per-request latency, failure rates and postprocessing cost. Downloads
+write real (zero-filled) files and report progress through the usual yt-dlp hooks; postprocessors
+only sleep, the way ytmp3 waits on an ffmpeg subprocess, and so do ffmpeg runs ytmp3 starts itself
+(the thumbnail conversions), which copy their input. urlopen() serves fake artwork.
+
+Besides unavailable videos, which fail every time, a backend can fail download attempts with
+transient network errors (cut off halfway through the download) and with HTTP 429s, decided per
+video and attempt, so ytmp3's retries of them eventually succeed. Such a failure repeats for
+failure_streak attempts in a row: with the default of 2, ytmp3's immediate fallback from cached
+metadata to a fresh extraction fails as well, and the item goes through the retry scheduler.
+
+    backend = fake_ytdlp.FakeBackend(tracks=500, bandwidth_kbps=2048)
+    fake_ytdlp.install(backend)
+"""
+import io
+import os
+import random
+import shutil
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import yt_dlp
+from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+
+REAL_YOUTUBEDL = yt_dlp.YoutubeDL
+OUTTMPL_FIELD = re.compile(r"%\((\w+)(?:,\s*'([^']*)')?\)s")
+
+
+class FakeBackend:
+    """ What the fake YouTube serves, and how fast. Sizes are in KiB, times in seconds. """
+    def __init__(self, tracks=100, track_kb=256, chunk_kb=32, bandwidth_kbps=0, latency=0.01,
+                 failure_rate=0.0, transient_rate=0.0, throttle_rate=0.0, failure_streak=2,
+                 postprocess_seconds=0.005, thumbnails=0, thumbnail_kb=32, seed=0):
+        self.tracks = tracks
+        self.track_kb = track_kb
+        self.chunk_kb = chunk_kb
+        self.bandwidth_kbps = bandwidth_kbps
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.transient_rate = transient_rate
+        self.throttle_rate = throttle_rate
+        self.failure_streak = failure_streak
+        self.postprocess_seconds = postprocess_seconds
+        # Distinct artwork images, shared round-robin by the tracks (each under its own URL); 0 for none
+        self.thumbnails = thumbnails
+        self.thumbnail_kb = thumbnail_kb
+        self.seed = seed
+        self.requests = 0
+        self.downloads = 0
+        self.failures = {'unavailable': 0, 'transient': 0, 'throttled': 0}
+        self.thumbnail_requests = 0
+        self._attempts = {}
+        self._streaks = {}   # video id -> (failure, further attempts it repeats for)
+        self._lock = threading.Lock()
+
+    def request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def fails(self, video_id):
+        """ Whether a video is 'unavailable'. Decided per id, so retries of it fail too. """
+        return random.Random(f"{self.seed}:{video_id}").random() < self.failure_rate
+
+    def failure(self, video_id):
+        """ How this download attempt of a video fails: 'unavailable', 'throttled', 'transient' or
+        None. Transient failures and throttling are decided per id and attempt, and then repeat
+        for the next failure_streak - 1 attempts. """
+        with self._lock:
+            attempt = self._attempts[video_id] = self._attempts.get(video_id, 0) + 1
+            failure, repeats = self._streaks.pop(video_id, (None, 0))
+            if repeats > 1:
+                self._streaks[video_id] = (failure, repeats - 1)
+        if failure is None and self.fails(video_id):
+            failure = 'unavailable'
+        elif failure is None:
+            roll = random.Random(f"{self.seed}:{video_id}:{attempt}").random()
+            if roll < self.throttle_rate:
+                failure = 'throttled'
+            elif roll < self.throttle_rate + self.transient_rate:
+                failure = 'transient'
+            else:
+                return None
+            if self.failure_streak > 1:
+                with self._lock:
+                    self._streaks[video_id] = (failure, self.failure_streak - 1)
+        with self._lock:
+            self.failures[failure] += 1
+        return failure
+
+    def thumbnail_url(self, video_id, index):
+        if not self.thumbnails:
+            return None
+        return f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg?artwork={index % self.thumbnails}"
+
+    def thumbnail(self, url):
+        """ The bytes of the artwork at a thumbnail_url(): the same for every URL of one artwork. """
+        with self._lock:
+            self.thumbnail_requests += 1
+        artwork = parse_qs(urlsplit(url).query).get('artwork', ['0'])[0]
+        data = f"fake artwork {artwork}\n".encode()
+        return (data * (self.thumbnail_kb * 1024 // len(data) + 1))[:self.thumbnail_kb * 1024]
+
+    def playlist(self, playlist_id):
+        return [self.video(f"{playlist_id}-{index:05d}", index) for index in range(self.tracks)]
+
+    def video(self, video_id, index=0):
+        return {
+            'id': video_id,
+            'title': f"Track {index}",
+            'artist': f"Artist {index % 7}",
+            'uploader': "Fake Uploader",
+            'duration': 180,
+            'ext': 'webm',
+            'format_id': '251',
+            'acodec': 'opus',
+            'filesize': self.track_kb * 1024,
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'thumbnail': self.thumbnail_url(video_id, index),
+        }
+
+
+class FakeYoutubeDL:
+    """ The subset of the YoutubeDL API that ytmp3 uses. """
+    backend = FakeBackend()
+    sanitize_info = staticmethod(REAL_YOUTUBEDL.sanitize_info)
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        outtmpl = self.params.get('outtmpl') or {}
+        self.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else {'default': outtmpl}
+        self.params['outtmpl'].setdefault('default', '%(title)s [%(id)s].%(ext)s')
+        self._progress_hooks = list(self.params.get('progress_hooks') or [])
+        self._postprocessor_hooks = list(self.params.get('postprocessor_hooks') or [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+
+    def add_postprocessor_hook(self, hook):
+        self._postprocessor_hooks.append(hook)
+
+    def extract_info(self, url, download=True, ie_key=None, extra_info=None, process=True, force_generic_extractor=False):
+        self.backend.request()
+        query = parse_qs(urlsplit(url).query)
+        if 'list' in query:
+            playlist_id = query['list'][0]
+            entries = self.backend.playlist(playlist_id)
+            if not process:
+                entries = ({'_type': 'url', 'ie_key': 'Youtube', 'url': entry['webpage_url'], 'id': entry['id'],
+                            'title': entry['title'], 'uploader': entry['uploader'], 'duration': entry['duration']}
+                           for entry in entries)
+            return {'_type': 'playlist', 'id': playlist_id, 'title': f"Playlist {playlist_id}", 'entries': entries}
+        info = self.backend.video(query.get('v', [url.rsplit('/', 1)[-1]])[0])
+        if not process:
+            return info
+        return self.process_ie_result(info, download=download)
+
+    def process_ie_result(self, ie_result, download=True, extra_info=None):
+        video_id = ie_result['id']
+        failure = self.backend.failure(video_id)
+        if failure == 'unavailable':
+            self.report_error(f"[youtube] {video_id}: Video unavailable")
+        if failure == 'throttled':
+            self.report_error(f"[youtube] {video_id}: Unable to download webpage: HTTP Error 429: Too Many Requests")
+        info = dict(ie_result)
+        if not download:
+            return info
+        filename = self.prepare_filename(info)
+        self.dl(filename, info, interrupted=failure == 'transient')
+        return dict(info, filepath=filename, requested_downloads=[{'filepath': filename, 'ext': info['ext']}])
+
+    def prepare_filename(self, info):
+        def field(match):
+            value = info.get(match.group(1))
+            return str(value if value is not None else match.group(2) or 'NA').replace(os.sep, '_')
+        return OUTTMPL_FIELD.sub(field, self.params['outtmpl']['default'])
+
+    def dl(self, name, info, subtitle=False, test=False, interrupted=False):
+        """ 'Download' a file of backend.track_kb KiB, at backend.bandwidth_kbps if set. An
+        interrupted download loses its connection halfway through. """
+        total = self.backend.track_kb * 1024
+        chunk = b'\0' * (self.backend.chunk_kb * 1024)
+        os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+        downloaded = 0
+        with open(name, 'wb') as f:
+            while downloaded < total:
+                if interrupted and downloaded >= total // 2:
+                    self.report_error("Connection reset by peer")
+                data = chunk[:total - downloaded]
+                if self.backend.bandwidth_kbps:
+                    time.sleep(len(data) / (self.backend.bandwidth_kbps * 1024))
+                f.write(data)
+                downloaded += len(data)
+                self._progress({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                                'filename': name, 'info_dict': info})
+        self._progress({'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total,
+                        'filename': name, 'info_dict': info})
+        with self.backend._lock:
+            self.backend.downloads += 1
+        return True, True
+
+    def post_process(self, filename, info, files_to_move=None):
+        """ Run the configured postprocessors, each costing backend.postprocess_seconds. """
+        info = dict(info, filepath=filename)
+        for postprocessor in self.params.get('postprocessors') or []:
+            key = postprocessor['key']
+            name = key[6:] if key.lower().startswith('ffmpeg') else key
+            self._postprocessor({'status': 'started', 'postprocessor': name, 'info_dict': info})
+            if self.backend.postprocess_seconds:
+                time.sleep(self.backend.postprocess_seconds)
+            self._postprocessor({'status': 'finished', 'postprocessor': name, 'info_dict': info})
+        return info
+
+    def report_error(self, message):
+        """ Like YoutubeDL's: pass the error to the logger, then raise it. """
+        message = f"ERROR: {message}"
+        logger = self.params.get('logger')
+        if logger is not None:
+            logger.error(message)
+        raise yt_dlp.utils.DownloadError(message)
+
+    def urlopen(self, req):
+        """ Fetch artwork from the backend; anything else is not served. """
+        url = req if isinstance(req, str) else req.get_full_url()
+        self.backend.request()
+        if not url.startswith('https://i.ytimg.com/'):
+            raise yt_dlp.utils.DownloadError(f"ERROR: fake_ytdlp does not serve {url}")
+        return io.BytesIO(self.backend.thumbnail(url))
+
+    def _progress(self, status):
+        for hook in self._progress_hooks:
+            hook(status)
+
+    def _postprocessor(self, status):
+        for hook in self._postprocessor_hooks:
+            hook(status)
+
+
+def fake_run_ffmpeg(self, input_path_opts, output_path_opts, *, expected_retcodes=(0,)):
+    """ Stands in for FFmpegPostProcessor.real_run_ffmpeg: waits backend.postprocess_seconds and
+    copies the first input to the first output. """
+    if FakeYoutubeDL.backend.postprocess_seconds:
+        time.sleep(FakeYoutubeDL.backend.postprocess_seconds)
+    shutil.copyfile(input_path_opts[0][0], output_path_opts[0][0])
+    return ''
+
+
+def install(backend):
+    """ Route every yt_dlp.YoutubeDL created from now on, and the ffmpeg runs of postprocessors
+    used outside of one (e.g. ytmp3's thumbnail conversions), to `backend`. """
+    FakeYoutubeDL.backend = backend
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    FFmpegPostProcessor.real_run_ffmpeg = fake_run_ffmpeg
@@ -1,37 +1,52 @@
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
-import yt_dlp
+import sys
+
+# `ytmp3 download ...` and `ytmp3 worker ...` run headless: hand over before Flask, waitress
+# and the page are loaded
+if __name__ == "__main__" and sys.argv[1:2] == ['download']:
+    import ytmp3_cli
+    sys.exit(ytmp3_cli.main(sys.argv[1:]))
+if __name__ == "__main__" and sys.argv[1:2] == ['worker']:
+    import ytmp3_worker
+    sys.exit(ytmp3_worker.main(sys.argv[2:]))
+
+from flask import Flask, render_template_string, request, jsonify, send_from_directory, Response, stream_with_context
 import threading
+import json
 import os
-import queue
-import concurrent.futures
-import re
+import time
 from waitress import serve
 import webbrowser
-import sys
+import argparse
+import hmac
+import ipaddress
 
-# --- Configuration ---
+from ytmp3_engine import (
+    BACKOFF, DOWNLOAD_POOL, DOWNLOAD_QUEUE, EVENTS, ITEM_TERMINAL_STATES, JOBS,
+    JOURNAL, LISTINGS, LISTING_PAGE_SIZE, LISTING_WAIT_SECONDS, LOG_BUFFER_LINES, LOG_LEVELS,
+    LOG_STORE, METADATA_CACHE, METRICS, POOL_STATS, RETRY_SCHEDULER, SETTINGS, THUMBNAIL_CACHE,
+    TRANSCODE_POOL, TRANSCODE_QUEUE, WORK_LEASES, apply_settings, create_job, download_songs_task,
+    get_base_path, get_format_options, listings_lock, log_message, resume_journaled_jobs,
+    start_listing, status_lock, _job_summary, _journal_job_record, _metric_family,
+    _settings_from_env, _song_from_item, _touch,
+)
 
-def get_base_path():
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    else:
-        # Not bundled, just running as a .py script
-        base_path = os.path.dirname(os.path.abspath(__file__))
-    return base_path
+# --- Configuration ---
 
-# ### MODIFICATION ###: This now points to the DIRECTORY where ffmpeg.exe and ffprobe.exe live
-FFMPEG_PATH = get_base_path() 
 STATIC_DIR = os.path.join(get_base_path(), 'static')
 
+# Waitress threads. Every open /events stream holds one, so keep plenty above the default 4.
+SERVER_THREADS = 16
 
-# In-memory dictionary to store download status and a lock for thread-safe updates
-DOWNLOAD_STATUS = {}
-status_lock = threading.Lock()
+# How long an /events stream waits after a change before sending, so bursts of progress
+# updates are coalesced into a single message
+EVENT_COALESCE_SECONDS = 0.25
+EVENT_KEEPALIVE_SECONDS = 15
 
-# Queue for live log output
-LOG_QUEUE = queue.Queue()
+# Shared secret remote workers must send in X-Worker-Token, if set (see --worker-token)
+WORKER_TOKEN = os.environ.get('YTMP3_WORKER_TOKEN')
+# Set when --host is not a loopback address. Clients on other machines then need the token
+# for anything that changes state (downloads, /config, ...).
+NETWORK_EXPOSED = False
 
 app = Flask(__name__)
 
@@ -90,10 +105,26 @@ HTML_TEMPLATE = """
                     <input type="radio" name="format" value="mp3" checked class="form-radio text-indigo-600 h-5 w-5 focus:ring-indigo-500">
                     <span class="ml-2 text-slate-700 dark:text-slate-300">MP3</span>
                 </label>
+                <label class="inline-flex items-center" title="Variable bitrate MP3 (V0): smaller files at about the same quality">
+                    <input type="radio" name="format" value="mp3-v0" class="form-radio text-indigo-600 h-5 w-5 focus:ring-indigo-500">
+                    <span class="ml-2 text-slate-700 dark:text-slate-300">MP3 VBR</span>
+                </label>
+                <label class="inline-flex items-center" title="Keep YouTube's AAC audio as-is, without re-encoding">
+                    <input type="radio" name="format" value="m4a" class="form-radio text-indigo-600 h-5 w-5 focus:ring-indigo-500">
+                    <span class="ml-2 text-slate-700 dark:text-slate-300">M4A</span>
+                </label>
+                <label class="inline-flex items-center" title="Keep YouTube's Opus audio as-is, without re-encoding">
+                    <input type="radio" name="format" value="opus" class="form-radio text-indigo-600 h-5 w-5 focus:ring-indigo-500">
+                    <span class="ml-2 text-slate-700 dark:text-slate-300">Opus</span>
+                </label>
                 <label class="inline-flex items-center">
                     <input type="radio" name="format" value="mp4" class="form-radio text-indigo-600 h-5 w-5 focus:ring-indigo-500">
                     <span class="ml-2 text-slate-700 dark:text-slate-300">MP4</span>
                 </label>
+                <label class="inline-flex items-center" title="List large playlists quickly; full details are fetched only for the songs you download">
+                    <input type="checkbox" id="fastListing" class="h-5 w-5 rounded-md text-indigo-600 focus:ring-indigo-500">
+                    <span class="ml-2 text-slate-700 dark:text-slate-300">Fast</span>
+                </label>
             </div>
             <button type="submit" id="fetchBtn"
                     class="bg-indigo-600 text-white font-semibold py-3 px-6 rounded-lg
@@ -118,6 +149,9 @@ HTML_TEMPLATE = """
 
         <div id="playlistInfo" class="hidden">
             <div id="playlistTitle" class="text-2xl font-bold mb-4 text-center"></div>
+            <div id="cachedNotice" class="text-xs text-center text-slate-500 dark:text-slate-400 -mt-3 mb-4 hidden">
+                Loaded from cache. <a href="#" id="refreshLink" class="text-indigo-600 dark:text-indigo-400 hover:underline">Refresh</a>
+            </div>
             <div id="selectButtons" class="flex justify-around gap-4 mb-4">
                 <button id="selectAllBtn" class="w-full bg-slate-200 dark:bg-slate-700 text-slate-800 dark:text-slate-200 font-semibold py-2 px-4 rounded-lg 
                                                hover:bg-slate-300 dark:hover:bg-slate-600 
@@ -141,12 +175,19 @@ HTML_TEMPLATE = """
                 <span class="text-indigo-600 dark:text-indigo-400">Total: <span id="totalItems">0</span></span>
                 <span class="text-green-600 dark:text-green-400">Downloaded: <span id="downloadedItems">0</span></span>
                 <span class="text-red-600 dark:text-red-400">Failed: <span id="failedItems">0</span></span>
+                <span class="text-slate-500 dark:text-slate-400">Skipped: <span id="skippedItems">0</span></span>
             </div>
 
-            <div id="progressList" class="space-y-4">
+            <div id="progressList" class="overflow-y-auto" style="max-height: 60vh;">
                 </div>
                 
-            <div id="resetContainer" class="mt-8 flex justify-center hidden">
+            <div id="resetContainer" class="mt-8 flex justify-center gap-4 hidden">
+                <button id="retryFailedBtn" class="w-full max-w-xs bg-amber-500 dark:bg-amber-600 text-white font-semibold py-3 px-6 rounded-lg 
+                                           hover:bg-amber-600 dark:hover:bg-amber-500 
+                                           focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-amber-500 dark:focus:ring-offset-slate-800
+                                           transition-all duration-300 shadow-md hover:shadow-lg hidden">
+                    Retry Failed
+                </button>
                 <button id="resetBtn" class="w-full max-w-xs bg-gray-500 dark:bg-gray-600 text-white font-semibold py-3 px-6 rounded-lg 
                                            hover:bg-gray-600 dark:hover:bg-gray-500 
                                            focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-gray-500 dark:focus:ring-offset-slate-800
@@ -191,6 +232,7 @@ HTML_TEMPLATE = """
         const totalItemsSpan = document.getElementById('totalItems');
         const downloadedItemsSpan = document.getElementById('downloadedItems');
         const failedItemsSpan = document.getElementById('failedItems');
+        const skippedItemsSpan = document.getElementById('skippedItems');
         const logBtn = document.getElementById('logBtn');
         const logModal = document.getElementById('logModal');
         const logContent = document.getElementById('logContent');
@@ -198,13 +240,23 @@ HTML_TEMPLATE = """
         const errorText = document.getElementById('errorText');
         const resetContainer = document.getElementById('resetContainer');
         const resetBtn = document.getElementById('resetBtn');
+        const retryFailedBtn = document.getElementById('retryFailedBtn');
+        const cachedNotice = document.getElementById('cachedNotice');
+        const refreshLink = document.getElementById('refreshLink');
+        const fastListingCheckbox = document.getElementById('fastListing');
 
         let pollingInterval;
         let logPollingInterval;
+        let eventSource = null;
+        let lastRevision = null;
+        let logCursor = 0;
+        const selectedIds = new Set();
         let fetchedSongs = [];
         let playlistTitle = "";
         let selectedFormat = "mp3";
         let isPlaylist = false; 
+        let currentJobId = null;
+        let currentListingId = null;
 
         function setDownloadUIState(downloading) {
             downloadSelectedBtn.disabled = downloading;
@@ -232,102 +284,133 @@ HTML_TEMPLATE = """
             }
         };
 
+        function appendLogs(logs) {
+            if (logs.length > 0) {
+                logContent.textContent += logs.join('\\n') + '\\n';
+                logContent.scrollTop = logContent.scrollHeight;
+            }
+        }
+
         async function fetchLogs() {
             try {
-                const response = await fetch('/logs');
-                const logs = await response.json();
-                if (logs.length > 0) {
-                    logContent.textContent += logs.join('\\n') + '\\n';
-                    logContent.scrollTop = logContent.scrollHeight;
-                }
+                const response = await fetch(`/logs?after=${logCursor}&job=${currentJobId}`);
+                const data = await response.json();
+                logCursor = data.cursor;
+                appendLogs(data.logs.map(line => line.message));
             } catch (error) {
                 console.error("Failed to fetch logs:", error);
             }
         }
 
-        fetchForm.addEventListener('submit', async (e) => {
+        fetchForm.addEventListener('submit', (e) => {
+            e.preventDefault();
+            fetchPlaylist(false);
+        });
+
+        refreshLink.addEventListener('click', (e) => {
             e.preventDefault();
+            fetchPlaylist(true);
+        });
+
+        async function fetchPlaylist(refresh) {
             const playlistUrl = playlistUrlInput.value;
             selectedFormat = document.querySelector('input[name="format"]:checked').value;
+            currentListingId = null;
+            fetchedSongs = [];
+            selectedIds.clear();
 
             loading.classList.remove('hidden');
             playlistInfo.classList.add('hidden');
-            progressList.innerHTML = '';
+            trackList.setRows([], 'select');
             statusContainer.classList.add('hidden');
             errorContainer.classList.add('hidden');
             resetContainer.classList.add('hidden');
             fetchBtn.disabled = true;
 
             try {
+                // Answers right away with a listing handle; the songs are extracted in the background
                 const response = await fetch('/fetch_playlist', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ url: playlistUrl, format: selectedFormat }),
+                    body: JSON.stringify({ url: playlistUrl, format: selectedFormat, refresh: refresh, fast: fastListingCheckbox.checked }),
                 });
                 const data = await response.json();
                 if (response.ok) {
-                    loading.classList.add('hidden');
-                    playlistInfo.classList.remove('hidden');
-                    playlistTitle = data.playlist_title;
-                    playlistTitleEl.textContent = playlistTitle;
-                    fetchedSongs = data.songs;
-                    isPlaylist = data.is_playlist; 
-                    
-                    selectAllBtn.style.display = isPlaylist ? 'block' : 'none';
-                    if (!isPlaylist) {
-                        downloadSelectedBtn.innerHTML = 'Download Selected (<span id="selectedCount">0</span>)';
+                    currentListingId = data.listing_id;
+                    if (data.done || data.songs.length > 0) {
+                        showPlaylist(data);
                     }
-                    
-                    totalItemsSpan.textContent = fetchedSongs.length;
-                    renderSongList(fetchedSongs);
-                    
-                    if (!isPlaylist) {
-                        document.getElementById(`song-${fetchedSongs[0].id}`).checked = true;
-                        updateSelectedCount();
+                    if (!data.done) {
+                        loadRemainingSongs(currentListingId);
                     }
                 } else {
-                    loading.classList.add('hidden');
-                    errorText.textContent = data.message;
-                    errorContainer.classList.remove('hidden');
+                    showFetchError(data.message);
                 }
             } catch (error) {
-                loading.classList.add('hidden');
-                errorText.textContent = `Network error: ${error.message}`;
-                errorContainer.classList.remove('hidden');
+                showFetchError(`Network error: ${error.message}`);
             } finally {
                 fetchBtn.disabled = false;
             }
-        });
+        }
+
+        function showFetchError(message) {
+            loading.classList.add('hidden');
+            errorText.textContent = message;
+            errorContainer.classList.remove('hidden');
+        }
+
+        function showPlaylist(data) {
+            loading.classList.add('hidden');
+            playlistInfo.classList.remove('hidden');
+            playlistTitle = data.playlist_title;
+            playlistTitleEl.textContent = playlistTitle;
+            cachedNotice.classList.toggle('hidden', !data.cached);
+            fetchedSongs = data.songs;
+            isPlaylist = data.is_playlist; 
+            
+            selectAllBtn.style.display = isPlaylist ? 'block' : 'none';
+            if (!isPlaylist) {
+                downloadSelectedBtn.innerHTML = 'Download Selected (<span id="selectedCount">0</span>)';
+            }
+            
+            totalItemsSpan.textContent = fetchedSongs.length;
+            renderSongList(fetchedSongs);
+            
+            if (!isPlaylist && fetchedSongs.length > 0) {
+                selectedIds.add(fetchedSongs[0].id);
+                trackList.render();
+                updateSelectedCount();
+            }
+        }
 
         selectAllBtn.addEventListener('click', () => {
-            const checkboxes = progressList.querySelectorAll('input[type="checkbox"]');
-            const allChecked = Array.from(checkboxes).every(cb => cb.checked);
-            checkboxes.forEach(cb => cb.checked = !allChecked);
+            // Selection lives in selectedIds, since only the visible rows have checkboxes
+            const allChecked = fetchedSongs.length > 0 && selectedIds.size === fetchedSongs.length;
+            selectedIds.clear();
+            if (!allChecked) fetchedSongs.forEach(song => selectedIds.add(song.id));
+            trackList.render();
             updateSelectedCount();
-            selectAllBtn.textContent = allChecked ? 'Select All' : 'Deselect All';
         });
 
         progressList.addEventListener('change', (e) => {
              if (e.target.type === 'checkbox') {
+                if (e.target.checked) {
+                    selectedIds.add(e.target.dataset.id);
+                } else {
+                    selectedIds.delete(e.target.dataset.id);
+                }
                 updateSelectedCount();
              }
         });
 
         function updateSelectedCount() {
-            const checkboxes = progressList.querySelectorAll('input[type="checkbox"]');
-            const selectedCount = Array.from(checkboxes).filter(cb => cb.checked).length;
-            selectedCountSpan.textContent = selectedCount;
-            
-            const allChecked = checkboxes.length > 0 && selectedCount === checkboxes.length;
+            selectedCountSpan.textContent = selectedIds.size;
+            const allChecked = fetchedSongs.length > 0 && selectedIds.size === fetchedSongs.length;
             selectAllBtn.textContent = allChecked ? 'Deselect All' : 'Select All';
         }
 
         downloadSelectedBtn.addEventListener('click', async () => {
-            const selectedSongs = Array.from(progressList.querySelectorAll('input[type="checkbox"]:checked'))
-                .map(cb => {
-                    const songId = cb.id.replace('song-', '');
-                    return fetchedSongs.find(s => s.id === songId);
-                });
+            const selectedSongs = fetchedSongs.filter(song => selectedIds.has(song.id));
 
             if (selectedSongs.length === 0) {
                 alert('Please select at least one song to download.');
@@ -335,14 +418,12 @@ HTML_TEMPLATE = """
             }
             
             logContent.textContent = '';
+            currentListingId = null;
             
             setDownloadUIState(true);
             statusContainer.classList.remove('hidden');
             statusText.textContent = 'Starting download...';
 
-            if (logPollingInterval) clearInterval(logPollingInterval);
-            logPollingInterval = setInterval(fetchLogs, 2000);
-
             try {
                 const response = await fetch('/download', {
                     method: 'POST',
@@ -356,82 +437,333 @@ HTML_TEMPLATE = """
                 });
 
                 if (response.ok) {
-                    statusText.textContent = 'Download started. Fetching status...';
-                    if (pollingInterval) clearInterval(pollingInterval);
-                    pollingInterval = setInterval(pollStatus, 1500);
+                    const job = await response.json();
+                    currentJobId = job.job_id;
+                    statusText.textContent = 'Download queued. Fetching status...';
+                    watchJob(currentJobId);
                 } else {
                     const error = await response.json();
                     statusText.textContent = `Error: ${error.message}`;
                     setDownloadUIState(false);
-                    if (logPollingInterval) clearInterval(logPollingInterval);
                 }
             } catch (error) {
                 statusText.textContent = `Network error: ${error.message}`;
                 setDownloadUIState(false);
-                if (logPollingInterval) clearInterval(logPollingInterval);
             }
         });
 
-        function renderSongList(songs) {
-            progressList.innerHTML = '';
-            songs.forEach((item, index) => {
-                const songItem = document.createElement('div');
-                songItem.className = 'p-3 bg-slate-50 dark:bg-slate-700 rounded-lg flex items-center shadow-sm space-x-4 transition-all duration-300 hover:shadow-md';
-                
-                const videoId = item.id;
-                const thumbnailUrl = `https://i.ytimg.com/vi/${videoId}/hqdefault.jpg`;
-                const placeholderUrl = 'https://placehold.co/48x48/e2e8f0/64748b?text=YT';
-                const thumbnail = `<img src="${thumbnailUrl}" class="w-12 h-12 rounded-lg object-cover" alt="Thumbnail" onerror="this.onerror=null; this.src='${placeholderUrl}';">`;
+        function stopWatching() {
+            if (eventSource) {
+                eventSource.close();
+                eventSource = null;
+            }
+            if (pollingInterval) clearInterval(pollingInterval);
+            if (logPollingInterval) clearInterval(logPollingInterval);
+        }
 
-                const artist = item.artist || 'Unknown Artist';
-                const album = item.album || 'Unknown Album';
-                
-                songItem.innerHTML = `
-                    <input type="checkbox" id="song-${item.id}" class="h-5 w-5 rounded-md text-indigo-600 focus:ring-indigo-500">
-                    <span class="text-sm font-semibold text-slate-400 dark:text-slate-500 w-6 text-right">${index + 1}.</span>
-                    ${thumbnail}
-                    <div class="flex-1 min-w-0">
-                        <div class="font-medium text-slate-700 dark:text-slate-200 truncate">${item.title}</div>
-                        <div class="text-sm text-slate-500 dark:text-slate-400 truncate">${artist} • ${album}</div>
-                    </div>
-                `;
-                progressList.appendChild(songItem);
+        function startPolling() {
+            // Poll for changed items instead of keeping an event stream open
+            lastRevision = null;
+            logCursor = 0;
+            logContent.textContent = '';
+            pollingInterval = setInterval(pollStatus, 1500);
+            logPollingInterval = setInterval(fetchLogs, 2000);
+        }
+
+        function watchJob(jobId) {
+            stopWatching();
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            eventSource = new EventSource(`/events/${jobId}`);
+            eventSource.addEventListener('snapshot', (e) => {
+                const data = JSON.parse(e.data);
+                // Every (re)connect replays the job's log, so start it over
+                logContent.textContent = '';
+                applyJobSummary(data);
+                updateProgressList(data.results);
+            });
+            eventSource.addEventListener('items', (e) => {
+                const data = JSON.parse(e.data);
+                applyJobSummary(data.job);
+                data.items.forEach(updateProgressItem);
+            });
+            eventSource.addEventListener('logs', (e) => appendLogs(JSON.parse(e.data)));
+            eventSource.addEventListener('done', (e) => {
+                stopWatching();
+                finishJob(JSON.parse(e.data));
+            });
+            eventSource.onerror = () => {
+                // The browser reconnects on its own (and gets a fresh snapshot). It gives up when the
+                // server refuses the stream (503: too many open), so poll instead; if the server is
+                // gone, pollStatus reports that.
+                if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+                    stopWatching();
+                    startPolling();
+                }
+            };
+        }
+
+        async function loadRemainingSongs(listingId) {
+            // Keep appending pages of a listing while the server is still extracting it
+            while (currentListingId === listingId) {
+                try {
+                    const response = await fetch(`/fetch_playlist/${listingId}?offset=${fetchedSongs.length}&limit=500&wait=10`);
+                    const data = await response.json();
+                    if (!response.ok || currentListingId !== listingId) return;
+                    if (playlistInfo.classList.contains('hidden')) {
+                        if (data.error && data.songs.length === 0) {
+                            showFetchError(`Failed to fetch info. (Details: ${data.error})`);
+                            return;
+                        }
+                        if (data.done || data.songs.length > 0) showPlaylist(data);
+                    } else if (data.songs.length > 0) {
+                        fetchedSongs = fetchedSongs.concat(data.songs);
+                        trackList.append(data.songs);
+                        totalItemsSpan.textContent = fetchedSongs.length;
+                        updateSelectedCount();
+                    }
+                    if (data.done) return;
+                } catch (error) {
+                    console.error('Failed to load more songs:', error);
+                    return;
+                }
+            }
+        }
+
+        // Song and progress rows share one virtualized list: rows have a fixed height and are
+        // positioned absolutely, so only the visible ones (plus a few either side) exist in the
+        // DOM, and their nodes are reused as the list scrolls. Updates touch only changed fields.
+        const ROW_HEIGHT = 84;
+        const ROW_GAP = 8;
+        const ROW_OVERSCAN = 8;
+        const THUMBNAIL_PLACEHOLDER = 'https://placehold.co/48x48/e2e8f0/64748b?text=YT';
+        const SLATE_ROW = {bg: 'bg-slate-50 dark:bg-slate-700', title: 'text-slate-700 dark:text-slate-200', detail: 'text-slate-500 dark:text-slate-400', label: 'text-slate-700 dark:text-slate-200'};
+        const BLUE_ROW = {bg: 'bg-blue-50 dark:bg-blue-900', title: 'text-blue-700 dark:text-blue-300', detail: 'text-blue-600 dark:text-blue-400', label: 'text-blue-700 dark:text-blue-300 animate-pulse'};
+        const ROW_STYLES = {
+            select: {...SLATE_ROW, text: () => ''},
+            pending: {...SLATE_ROW, text: () => 'Pending'},
+            finished: {bg: 'bg-green-50 dark:bg-green-900', title: 'text-green-700 dark:text-green-300', detail: 'text-green-600 dark:text-green-400', label: 'text-green-700 dark:text-green-300', text: () => 'Finished'},
+            retrying: {bg: 'bg-amber-50 dark:bg-amber-900', title: 'text-amber-700 dark:text-amber-300', detail: 'text-amber-600 dark:text-amber-400', label: 'text-amber-700 dark:text-amber-300', text: item => `Retrying (${item.attempts})`},
+            skipped: {bg: 'bg-slate-50 dark:bg-slate-700', title: 'text-slate-500 dark:text-slate-400', detail: 'text-slate-400 dark:text-slate-500', label: 'text-slate-500 dark:text-slate-400', text: () => 'Already downloaded'},
+            error: {bg: 'bg-red-50 dark:bg-red-900', title: 'text-red-700 dark:text-red-300', detail: 'text-red-600 dark:text-red-400', label: 'text-red-700 dark:text-red-300', text: () => 'Failed'},
+            downloading: {...BLUE_ROW, bar: true, text: () => ''},
+            downloaded: {...BLUE_ROW, text: () => 'Waiting to convert'},
+            converting: {...BLUE_ROW, text: () => 'Converting'},
+            tagging: {...BLUE_ROW, text: () => 'Tagging'},
+        };
+
+        function createRow() {
+            const node = document.createElement('div');
+            node.style.height = `${ROW_HEIGHT - ROW_GAP}px`;
+            node.innerHTML = `
+                <input type="checkbox" class="h-5 w-5 rounded-md text-indigo-600 focus:ring-indigo-500 flex-shrink-0">
+                <span class="text-sm font-semibold text-slate-400 dark:text-slate-500 w-8 text-right flex-shrink-0"></span>
+                <img class="w-12 h-12 rounded-lg object-cover flex-shrink-0" alt="Thumbnail" loading="lazy">
+                <div class="flex-1 min-w-0">
+                    <div></div>
+                    <div></div>
+                    <div class="w-full h-2 bg-blue-200 dark:bg-blue-700 rounded-full mt-1"><div class="h-2 bg-blue-600 rounded-full transition-all duration-300 ease-out"></div></div>
+                </div>
+                <span></span>`;
+            const [checkbox, order, thumbnail, details, label] = node.children;
+            const [title, detail, bar] = details.children;
+            node.parts = {checkbox, order, thumbnail, title, detail, bar, fill: bar.firstElementChild, label};
+            node.state = {};
+            thumbnail.onerror = () => {
+                if (thumbnail.src !== THUMBNAIL_PLACEHOLDER) thumbnail.src = THUMBNAIL_PLACEHOLDER;
+            };
+            return node;
+        }
+
+        function setIfChanged(node, field, value, apply) {
+            if (node.state[field] !== value) {
+                node.state[field] = value;
+                apply(value);
+            }
+        }
+
+        function fillRow(node, row, index, mode) {
+            const parts = node.parts;
+            const style = mode === 'select' ? ROW_STYLES.select : (ROW_STYLES[row.status] || ROW_STYLES.pending);
+            setIfChanged(node, 'top', index, value => node.style.top = `${value * ROW_HEIGHT}px`);
+            setIfChanged(node, 'id', row.id, value => {
+                parts.thumbnail.src = `https://i.ytimg.com/vi/${value}/hqdefault.jpg`;
+                parts.checkbox.dataset.id = value;
+            });
+            setIfChanged(node, 'mode', mode, value => parts.checkbox.classList.toggle('hidden', value !== 'select'));
+            if (mode === 'select' && parts.checkbox.checked !== selectedIds.has(row.id)) {
+                parts.checkbox.checked = selectedIds.has(row.id);
+            }
+            setIfChanged(node, 'order', mode === 'select' ? index + 1 : row.order + 1, value => parts.order.textContent = `${value}.`);
+            setIfChanged(node, 'title', row.title, value => parts.title.textContent = value);
+            setIfChanged(node, 'detail', `${row.artist || 'Unknown Artist'} • ${row.album || 'Unknown Album'}`, value => parts.detail.textContent = value);
+            setIfChanged(node, 'style', style, value => {
+                node.className = `absolute inset-x-0 p-3 rounded-lg shadow-sm flex items-center space-x-4 transition-colors duration-300 ${value.bg}`;
+                parts.title.className = `font-medium truncate ${value.title}`;
+                parts.detail.className = `text-sm truncate ${value.detail}`;
+                parts.label.className = `text-sm font-bold flex-shrink-0 ${value.label}`;
+                parts.bar.classList.toggle('hidden', !value.bar);
             });
+            setIfChanged(node, 'label', style.text(row), value => parts.label.textContent = value);
+            if (style.bar) {
+                setIfChanged(node, 'progress', row.progress || 0, value => parts.fill.style.width = `${value}%`);
+            }
+        }
+
+        class VirtualList {
+            constructor(container) {
+                this.container = container;
+                this.canvas = document.createElement('div');
+                this.canvas.className = 'relative';
+                container.appendChild(this.canvas);
+                this.rows = [];
+                this.positions = new Map(); // row id -> index in rows
+                this.nodes = new Map();     // index -> node currently on screen
+                this.spare = [];            // detached nodes, reused for rows scrolling into view
+                this.mode = 'select';
+                this.frame = null;
+                container.addEventListener('scroll', () => this.scheduleRender());
+                window.addEventListener('resize', () => this.scheduleRender());
+            }
+
+            // Replace all rows. The scroll position is kept unless the list changes mode.
+            setRows(rows, mode) {
+                if (mode !== this.mode) {
+                    this.mode = mode;
+                    this.container.scrollTop = 0;
+                }
+                this.rows = [];
+                this.positions.clear();
+                this.append(rows);
+            }
+
+            append(rows) {
+                rows.forEach(row => {
+                    this.positions.set(row.id, this.rows.length);
+                    this.rows.push(row);
+                });
+                this.canvas.style.height = `${this.rows.length * ROW_HEIGHT}px`;
+                this.render();
+            }
+
+            update(row) {
+                const index = this.positions.get(row.id);
+                if (index === undefined) {
+                    this.append([row]);
+                    return;
+                }
+                this.rows[index] = row;
+                const node = this.nodes.get(index);
+                if (node) fillRow(node, row, index, this.mode);
+            }
+
+            scheduleRender() {
+                if (this.frame === null) {
+                    this.frame = requestAnimationFrame(() => {
+                        this.frame = null;
+                        this.render();
+                    });
+                }
+            }
+
+            render() {
+                const top = this.container.scrollTop;
+                const first = Math.max(0, Math.floor(top / ROW_HEIGHT) - ROW_OVERSCAN);
+                const last = Math.min(this.rows.length, Math.ceil((top + this.container.clientHeight) / ROW_HEIGHT) + ROW_OVERSCAN);
+                for (const [index, node] of this.nodes) {
+                    if (index < first || index >= last) {
+                        node.remove();
+                        this.nodes.delete(index);
+                        this.spare.push(node);
+                    }
+                }
+                for (let index = first; index < last; index++) {
+                    let node = this.nodes.get(index);
+                    if (!node) {
+                        node = this.spare.pop() || createRow();
+                        this.nodes.set(index, node);
+                        this.canvas.appendChild(node);
+                    }
+                    fillRow(node, this.rows[index], index, this.mode);
+                }
+            }
+        }
+
+        const trackList = new VirtualList(progressList);
+
+        function renderSongList(songs) {
+            trackList.setRows(songs, 'select');
             updateSelectedCount();
         }
 
+        function applyJobSummary(data) {
+            if (data.status === 'downloading') {
+                statusText.textContent = `Downloading (${data.downloaded_items}/${data.total_items})...`;
+            } else if (data.status === 'queued') {
+                statusText.textContent = 'Queued, waiting for a free download slot...';
+            }
+            totalItemsSpan.textContent = data.total_items;
+            downloadedItemsSpan.textContent = data.downloaded_items;
+            failedItemsSpan.textContent = data.failed_items;
+            skippedItemsSpan.textContent = data.skipped_items || 0;
+        }
+
+        function finishJob(data) {
+            setDownloadUIState(false);
+            applyJobSummary(data);
+
+            statusContainer.className = 'p-4 rounded-lg mb-6 transition-all duration-300'; // Reset
+            if (data.status === 'finished') {
+                statusContainer.classList.add('bg-green-50', 'dark:bg-green-900', 'text-green-600', 'dark:text-green-300');
+                statusText.textContent = 'Download finished!';
+            } else {
+                statusContainer.classList.add('bg-red-50', 'dark:bg-red-900', 'text-red-600', 'dark:text-red-300');
+                statusText.textContent = `Download failed: ${data.error_message || 'Unknown error'}`;
+            }
+            retryFailedBtn.classList.toggle('hidden', !(data.failed_items > 0));
+            resetContainer.classList.remove('hidden');
+        }
+
+        retryFailedBtn.addEventListener('click', async () => {
+            const response = await fetch('/retry_failed', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ job_id: currentJobId }),
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                statusText.textContent = `Error: ${data.message}`;
+                return;
+            }
+            setDownloadUIState(true);
+            statusText.textContent = data.message;
+            watchJob(currentJobId);
+        });
+
         async function pollStatus() {
             try {
-                const response = await fetch('/status');
+                const query = lastRevision === null ? '' : `?since=${lastRevision}`;
+                const response = await fetch(`/status/${currentJobId}${query}`);
+                if (response.status === 304) return;
                 const data = await response.json();
 
+                applyJobSummary(data);
+                if (lastRevision === null) {
+                    updateProgressList(data.results);
+                } else {
+                    data.results.forEach(updateProgressItem);
+                }
+                lastRevision = data.revision;
+
                 if (data.status === 'finished' || data.status === 'error') {
-                    clearInterval(pollingInterval);
-                    clearInterval(logPollingInterval);
-                    setDownloadUIState(false);
-                    
-                    statusContainer.className = 'p-4 rounded-lg mb-6 transition-all duration-300'; // Reset
-                    if (data.status === 'finished') {
-                        statusContainer.classList.add('bg-green-50', 'dark:bg-green-900', 'text-green-600', 'dark:text-green-300');
-                        statusText.textContent = 'Download finished!';
-                    } else {
-                        statusContainer.classList.add('bg-red-50', 'dark:bg-red-900', 'text-red-600', 'dark:text-red-300');
-                        statusText.textContent = `Download failed: ${data.error_message || 'Unknown error'}`;
-                    }
-                    resetContainer.classList.remove('hidden');
+                    stopWatching();
+                    finishJob(data);
                     fetchLogs();
-                } else if (data.status === 'downloading') {
-                    statusText.textContent = `Downloading (${data.downloaded_items}/${data.total_items})...`;
                 }
-
-                totalItemsSpan.textContent = data.total_items;
-                downloadedItemsSpan.textContent = data.downloaded_items;
-                failedItemsSpan.textContent = data.failed_items;
-
-                updateProgressList(data.results);
             } catch (error) {
-                clearInterval(pollingInterval);
-                clearInterval(logPollingInterval);
+                stopWatching();
                 setDownloadUIState(false);
                 statusText.textContent = 'Error fetching status. Please try again.';
                 resetContainer.classList.remove('hidden');
@@ -440,6 +772,7 @@ HTML_TEMPLATE = """
         }
         
         resetBtn.addEventListener('click', () => {
+            stopWatching();
             playlistInfo.classList.add('hidden');
             resetContainer.classList.add('hidden');
             statusContainer.classList.add('hidden');
@@ -451,12 +784,16 @@ HTML_TEMPLATE = """
             totalItemsSpan.textContent = '0';
             downloadedItemsSpan.textContent = '0';
             failedItemsSpan.textContent = '0';
+            skippedItemsSpan.textContent = '0';
             
-            progressList.innerHTML = '';
+            trackList.setRows([], 'select');
             logContent.textContent = '';
             
             fetchedSongs = [];
+            selectedIds.clear();
             playlistTitle = "";
+            currentJobId = null;
+            currentListingId = null;
             
             setDownloadUIState(false);
             fetchBtn.disabled = false;
@@ -464,181 +801,34 @@ HTML_TEMPLATE = """
         });
 
         function updateProgressList(results) {
-            progressList.innerHTML = '';
-            results.forEach(item => {
-                const progressItem = document.createElement('div');
-                
-                const videoId = item.id;
-                const thumbnailUrl = `https://i.ytimg.com/vi/${videoId}/hqdefault.jpg`;
-                const placeholderUrl = 'https://placehold.co/48x48/e2e8f0/64748b?text=YT';
-                const thumbnail = `<img src="${thumbnailUrl}" class="w-12 h-12 rounded-lg mr-4 object-cover" alt="Thumbnail" onerror="this.onerror=null; this.src='${placeholderUrl}';">`;
-                
-                const title = item.title;
-                const artist = item.artist || 'Unknown Artist';
-                const album = item.album || 'Unknown Album';
-                
-                const progress = item.progress || 0;
-                const status = item.status;
-                const order = item.order + 1;
-                
-                progressItem.className = 'p-4 rounded-lg shadow-sm flex items-center justify-between transition-all duration-300';
-                let contentHTML = '';
-                let bgColor = 'bg-slate-50 dark:bg-slate-700';
-                
-                if (status === 'finished') {
-                    bgColor = 'bg-green-50 dark:bg-green-900';
-                    contentHTML = `<div class="flex items-center min-w-0"><span class="text-sm font-semibold text-slate-400 dark:text-slate-500 mr-2 w-6 text-right">${order}.</span>${thumbnail}<div class="flex-1 ml-4 min-w-0"><div class="text-sm font-medium text-green-700 dark:text-green-300 truncate">${title}</div><div class="text-sm text-green-600 dark:text-green-400 truncate">${artist} • ${album}</div></div></div><span class="text-sm font-bold text-green-700 dark:text-green-300 ml-4 flex-shrink-0">Finished</span>`;
-                } else if (status === 'error') {
-                    bgColor = 'bg-red-50 dark:bg-red-900';
-                    contentHTML = `<div class="flex items-center min-w-0"><span class="text-sm font-semibold text-slate-400 dark:text-slate-500 mr-2 w-6 text-right">${order}.</span>${thumbnail}<div class="flex-1 ml-4 min-w-0"><div class="text-sm font-medium text-red-700 dark:text-red-300 truncate">${title}</div><div class="text-sm text-red-600 dark:text-red-400 truncate">${artist} • ${album}</div></div></div><span class="text-sm font-bold text-red-700 dark:text-red-300 ml-4 flex-shrink-0">Failed</span>`;
-                } else if (status === 'downloading') {
-                    bgColor = 'bg-blue-50 dark:bg-blue-900';
-                    contentHTML = `<div class="flex items-center w-full"><span class="text-sm font-semibold text-slate-400 dark:text-slate-500 mr-2 w-6 text-right">${order}.</span>${thumbnail}<div class="flex-1 ml-4 min-w-0"><div class="text-sm font-medium text-blue-700 dark:text-blue-300 truncate">${title}</div><div class="text-sm text-blue-600 dark:text-blue-400 truncate">${artist} • ${album}</div><div class="w-full h-2 bg-blue-200 dark:bg-blue-700 rounded-full mt-1"><div class="h-2 bg-blue-600 rounded-full transition-all duration-300 ease-out" style="width: ${progress}%"></div></div></div></div>`;
-                } else { // pending
-                    bgColor = 'bg-slate-50 dark:bg-slate-700';
-                    contentHTML = `<div class="flex items-center min-w-0"><span class="text-sm font-semibold text-slate-400 dark:text-slate-500 mr-2 w-6 text-right">${order}.</span>${thumbnail}<div class="flex-1 ml-4 min-w-0"><div class="text-sm font-medium text-slate-700 dark:text-slate-200 truncate">${title}</div><div class="text-sm text-slate-500 dark:text-slate-400 truncate">${artist} • ${album}</div></div></div><span class="text-sm font-bold text-slate-700 dark:text-slate-200 ml-4 flex-shrink-0">Pending</span>`;
-                }
-                
-                progressItem.classList.add(...bgColor.split(' '));
-                progressItem.innerHTML = contentHTML;
-                progressList.appendChild(progressItem);
-            });
+            trackList.setRows(results, 'progress');
+        }
+
+        function updateProgressItem(item) {
+            trackList.update(item);
         }
     </script>
 </body>
 </html>
 """
 
-# --- Helper functions for download process ---
-def sanitize_filename(name):
-    return re.sub(r'[\\/*?:"<>|]', "", name)
-
-def _download_single_song(song, playlist_folder, format_options, log_file_path, is_playlist):
-    global DOWNLOAD_STATUS
-    video_id = song['id']
-
-    class MyLogger:
-        def debug(self, msg):
-            if 'Destination' not in msg:
-                LOG_QUEUE.put(msg)
-        def warning(self, msg): LOG_QUEUE.put(f"[WARNING] {msg}")
-        def error(self, msg): LOG_QUEUE.put(f"[ERROR] {msg}")
-
-    def progress_hook(d):
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-            downloaded_bytes = d.get('downloaded_bytes', 0)
-            if total_bytes > 0:
-                progress = (downloaded_bytes / total_bytes) * 100
-                with status_lock:
-                    if video_id in DOWNLOAD_STATUS['results']:
-                        DOWNLOAD_STATUS['results'][video_id]['progress'] = progress
-
-    def postprocessor_hook(d):
-        if d['status'] == 'finished':
-            with status_lock:
-                if video_id in DOWNLOAD_STATUS['results']:
-                    item = DOWNLOAD_STATUS['results'][video_id]
-                    if item['status'] != 'finished':
-                        item['status'] = 'finished'
-                        item['progress'] = 100.0
-                        DOWNLOAD_STATUS['downloaded_items'] += 1
-                        try:
-                            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                                log_file.write(f"{item['title']}\n")
-                        except Exception as e:
-                            LOG_QUEUE.put(f"[ERROR] Could not write to log file: {e}")
-
-    if is_playlist:
-        output_template = os.path.join(
-            playlist_folder, 
-            f"{song['order'] + 1:02d} - %(artist, 'Unknown Artist')s - %(title)s.%(ext)s"
-        )
-    else:
-        output_template = os.path.join(
-            playlist_folder, 
-            f"%(artist, 'Unknown Artist')s - %(title)s.%(ext)s"
-        )
-
-    ydl_opts = {
-        'outtmpl': output_template,
-        'writethumbnail': True,
-        'ffmpeg_location': FFMPEG_PATH, # ### MODIFICATION ###: This is now a directory
-        'yesplaylist': False,
-        'ignoreerrors': False,
-        'progress_hooks': [progress_hook],
-        'postprocessor_hooks': [postprocessor_hook],
-        'logger': MyLogger(),
-        'retries': 5,
-        'fragment_retries': 5,
-        'quiet': True,
-        'extractor_args': {"youtube": {"player_client": ["default"]}},
-        **format_options
-    }
-
-    try:
-        with status_lock:
-            if video_id in DOWNLOAD_STATUS['results']:
-                DOWNLOAD_STATUS['results'][video_id]['status'] = 'downloading'
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
-    except Exception as e:
-        with status_lock:
-            if video_id in DOWNLOAD_STATUS['results']:
-                item = DOWNLOAD_STATUS['results'][video_id]
-                if item['status'] != 'finished':
-                    item['status'] = 'error'
-                    item['error_message'] = str(e)
-                    DOWNLOAD_STATUS['failed_items'] += 1
-        LOG_QUEUE.put(f"Failed to download {song['title']}: {e}")
-
-def download_songs_task(songs, playlist_title, format_type, is_playlist):
-    global DOWNLOAD_STATUS
-    
-    try:
-        music_dir = os.path.expanduser(r'~\Music')
-        base_folder = os.path.join(music_dir, 'YTMusicDownloader')
-        
-        if is_playlist:
-            playlist_folder = os.path.join(base_folder, sanitize_filename(playlist_title))
-        else:
-            playlist_folder = base_folder
-        
-        if not os.path.exists(playlist_folder):
-            os.makedirs(playlist_folder)
-            
-    except Exception as e:
-        with status_lock:
-            DOWNLOAD_STATUS['status'] = 'error'
-            DOWNLOAD_STATUS['error_message'] = f"Failed to create playlist folder: {e}"
-        return
-
-    log_file_path = os.path.join(playlist_folder, 'downloaded.txt')
-
-    if format_type == 'mp3':
-        format_options = {
-            'format': 'bestaudio/best',
-            'postprocessors': [
-                {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '320'},
-                {'key': 'EmbedThumbnail'},
-            ]
-        }
-    else: # mp4
-        format_options = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'postprocessors': [
-                {'key': 'EmbedThumbnail'},
-                {'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'},
-            ]
-        }
+# Long-polling requests hold a waitress thread, so at most half of them may wait at once;
+# the rest get an immediate answer and poll again
+_long_poll_slots = threading.BoundedSemaphore(max(1, SERVER_THREADS // 2))
 
-    max_workers = 4
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(_download_single_song, song, playlist_folder, format_options, log_file_path, is_playlist) for song in songs]
-        concurrent.futures.wait(futures)
+# Every open /events stream holds a waitress thread for as long as its job runs. Together with
+# the long polls this still leaves a quarter of the threads for everything else.
+_event_stream_slots = threading.BoundedSemaphore(max(1, SERVER_THREADS // 4))
+# Sent with the 503 for a stream over the limit; the UI polls /status instead
+EVENT_STREAM_RETRY_SECONDS = 5
 
-    with status_lock:
-        DOWNLOAD_STATUS['status'] = 'finished'
+def _page_with_wait(listing, offset, limit, wait):
+    if wait > 0 and _long_poll_slots.acquire(blocking=False):
+        try:
+            return listing.page(offset, limit, wait)
+        finally:
+            _long_poll_slots.release()
+    return listing.page(offset, limit, 0)
 
 # --- Flask Routes ---
 @app.route("/")
@@ -650,64 +840,91 @@ def favicon():
     try:
         return send_from_directory(STATIC_DIR, 'favicon.ico', mimetype='image/vnd.microsoft.icon')
     except Exception as e:
-        LOG_QUEUE.put(f"[ERROR] Could not serve favicon: {e}")
+        log_message(f"[ERROR] Could not serve favicon: {e}", 'error')
         return "", 404
 
 @app.route("/fetch_playlist", methods=["POST"])
 def fetch_playlist():
+    """ Start listing a playlist or video URL and return a handle to it right away.
+
+    The response is a page of the listing (see PlaylistListing.page) with its listing_id: 200
+    once the listing is complete (e.g. from the cache), 202 while it is still being extracted.
+    Fetch the rest from /fetch_playlist/<listing_id>. {"wait": <seconds>} waits for the first
+    page (fast mode) or the whole result (full mode) before answering.
+    """
     playlist_url = request.json.get("url")
     if not playlist_url:
         return jsonify({"message": "Playlist or Video URL is required."}), 400
+    fast = bool(request.json.get("fast"))
     try:
-        ydl_info_opts = {
-            'quiet': True, 
-            'noplaylist': False, 
-            'extractor_args': {"youtube": {"player_client": ["default"]}}
-        }
-        with yt_dlp.YoutubeDL(ydl_info_opts) as ydl:
-            info = ydl.extract_info(playlist_url, download=False)
-            if not info:
-                raise Exception("yt-dlp could not extract any info. The URL might be invalid, private, or geo-restricted.")
-            
-            songs = []
-            is_playlist = False 
-            
-            if 'entries' in info:
-                is_playlist = True
-                playlist_title = info.get('title', 'Unknown Playlist')
-                for index, entry in enumerate(info['entries']):
-                    if entry and 'id' in entry and 'title' in entry:
-                        songs.append({
-                            'id': entry['id'],
-                            'title': entry['title'],
-                            'uploader': entry.get('uploader'),
-                            'artist': entry.get('artist', entry.get('uploader', 'Unknown Artist')),
-                            'album': entry.get('album', playlist_title),
-                            'thumbnail': entry.get('thumbnail'),
-                            'order': index
-                        })
-            else:
-                is_playlist = False
-                playlist_title = info.get('title', 'Unknown Video')
-                songs.append({
-                    'id': info['id'],
-                    'title': info['title'],
-                    'uploader': info.get('uploader'),
-                    'artist': info.get('artist', info.get('uploader', 'Unknown Artist')),
-                    'album': info.get('album', 'Unknown Album'),
-                    'thumbnail': info.get('thumbnail'),
-                    'order': 0
-                })
-        
-        return jsonify({"playlist_title": playlist_title, "songs": songs, "is_playlist": is_playlist}), 200
-    
-    except Exception as e:
-        LOG_QUEUE.put(f"[ERROR] Failed to fetch info: {str(e)}")
-        return jsonify({"message": f"Failed to fetch info. (Details: {str(e)})"}), 500
+        limit, wait = request.json.get("limit"), request.json.get("wait")
+        limit = max(1, int(limit)) if limit is not None else (LISTING_PAGE_SIZE if fast else None)
+        wait = min(LISTING_WAIT_SECONDS, max(0.0, float(wait))) if wait is not None else 0.0
+    except (TypeError, ValueError):
+        return jsonify({"message": "limit and wait must be numbers."}), 400
+    listing = start_listing(playlist_url, refresh=bool(request.json.get("refresh")), fast=fast)
+    page = _page_with_wait(listing, 0, limit, wait)
+    if page['error'] and not page['songs']:
+        return jsonify({"message": f"Failed to fetch info. (Details: {page['error']})"}), 500
+    return jsonify(page), 200 if page['done'] else 202
+
+@app.route("/fetch_playlist/<listing_id>")
+def fetch_playlist_page(listing_id):
+    """ Page through a listing: ?offset=&limit=, waiting up to ?wait= seconds for songs still being listed. """
+    with listings_lock:
+        listing = LISTINGS.get(listing_id)
+    if listing is None:
+        return jsonify({"message": "Unknown or expired listing."}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, request.args.get('limit', LISTING_PAGE_SIZE, type=int))
+    wait = min(LISTING_WAIT_SECONDS, max(0.0, request.args.get('wait', 0, type=float)))
+    return jsonify(_page_with_wait(listing, offset, limit, wait))
+
+@app.route("/retry_failed", methods=["POST"])
+def retry_failed():
+    """ Queue the failed items of a job again (the most recent job unless {"job_id": ...} is given). """
+    job_id = (request.json or {}).get("job_id") if request.is_json else None
+    with status_lock:
+        if job_id is None and JOBS:
+            job_id = next(reversed(JOBS))
+        job = JOBS.get(job_id)
+        if job is None:
+            return jsonify({"message": "Unknown job."}), 404
+        failed = [item for item in job['results'].values() if item['status'] == 'error']
+        if not failed:
+            return jsonify({"message": "This job has no failed items."}), 400
+        for item in failed:
+            item['status'] = 'pending'
+            item['progress'] = 0.0
+            item['attempts'] = 0
+            item.pop('error_message', None)
+            _touch(job, item)
+        job['failed_items'] -= len(failed)
+        job['status'] = 'queued'
+        job['finished_at'] = None
+        _touch(job)
+        # Re-journal the job so a restart resumes the retried items instead of restoring their failure
+        records = [_journal_job_record(job, [_song_from_item(item) for item in job['results'].values()])]
+        records += [{'event': 'item', 'job_id': job_id, 'id': item['id'], 'status': item['status'],
+                     'error_message': item.get('error_message')}
+                    for item in job['results'].values() if item['status'] in ITEM_TERMINAL_STATES]
+        songs = [_song_from_item(item) for item in failed]
+    for record in records:
+        JOURNAL.append(record)
+    download_songs_task(job_id, songs, job['playlist_title'], job['format'], job['is_playlist'])
+    return jsonify({"message": f"Retrying {len(songs)} failed item(s).", "job_id": job_id}), 202
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(dict(METADATA_CACHE.summary(), thumbnails=THUMBNAIL_CACHE.summary()))
+
+@app.route("/cache/clear", methods=["POST"])
+def clear_cache():
+    METADATA_CACHE.clear()
+    return jsonify({"message": "Metadata cache cleared."})
 
 @app.route("/download", methods=["POST"])
 def download_selected_songs():
-    global DOWNLOAD_STATUS
     data = request.json
     selected_songs = data.get("songs")
     playlist_title = data.get("playlist_title", "Unknown_Playlist")
@@ -716,52 +933,308 @@ def download_selected_songs():
     
     if not selected_songs:
         return jsonify({"message": "No songs were selected for download."}), 400
+    try:
+        get_format_options(selected_format)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     
+    job = create_job(selected_songs, playlist_title, selected_format, is_playlist)
+    download_songs_task(job['id'], selected_songs, playlist_title, selected_format, is_playlist)
+    return jsonify({"message": "Download queued successfully.", "job_id": job['id']}), 202
+
+def _job_status_response(job_id=None):
+    """ Build the /status response for a job (the most recent one if job_id is None).
+
+    Supports ?since=<revision> to only return the items changed after that revision,
+    and answers If-None-Match with 304 when the job has not changed at all.
+    """
+    since = request.args.get('since', type=int)
     with status_lock:
-        DOWNLOAD_STATUS = {
-            'total_items': len(selected_songs),
-            'downloaded_items': 0,
-            'failed_items': 0,
-            'status': 'downloading',
-            'results': {song['id']: {
-                'id': song['id'], 
-                'title': song['title'],
-                'uploader': song.get('uploader'),
-                'artist': song.get('artist'),
-                'album': song.get('album'),
-                'status': 'pending',
-                'progress': 0.0,
-                'thumbnail': song.get('thumbnail'), 
-                'order': song['order']
-            } for song in selected_songs}
-        }
-    
-    thread = threading.Thread(target=download_songs_task, args=(selected_songs, playlist_title, selected_format, is_playlist))
-    thread.start()
-    return jsonify({"message": "Download started successfully."}), 202
+        if job_id is None:
+            if not JOBS:
+                return jsonify({})
+            job_id = next(reversed(JOBS))
+        job = JOBS.get(job_id)
+        if job is None:
+            return jsonify({"message": "Unknown job."}), 404
+        etag = f"{job_id}-{job['revision']}-{since if since is not None else 'all'}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        response_data = _job_summary(job)
+        if since is None:
+            response_data['results'] = [dict(item) for item in job['results'].values()]
+        else:
+            response_data['since'] = since
+            response_data['results'] = [dict(item) for item in job['results'].values() if item['revision'] > since]
+    response = jsonify(response_data)
+    response.set_etag(etag)
+    return response
 
 @app.route("/status")
 def get_status():
+    """ Status of the most recently submitted job (kept for older clients). """
+    return _job_status_response()
+
+@app.route("/status/<job_id>")
+def get_job_status(job_id):
+    return _job_status_response(job_id)
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _read_job_logs(subscriber):
+    """ New log lines of the subscriber's job, advancing its cursor. """
+    lines, subscriber.log_cursor, _ = LOG_STORE.read(after=subscriber.log_cursor, job_id=subscriber.job_id)
+    return [line['message'] for line in lines]
+
+@app.route("/events/<job_id>")
+def job_events(job_id):
+    """ Server-Sent Events stream for one job.
+
+    Sends a full 'snapshot' first, then 'items' messages carrying only the items that
+    changed since the previous message, 'logs' with new log lines, and a final 'done'.
+    """
     with status_lock:
-        sorted_results = sorted(DOWNLOAD_STATUS.get('results', {}).values(), key=lambda x: x.get('order', 0))
-        response_data = DOWNLOAD_STATUS.copy()
-        response_data['results'] = sorted_results
-        return jsonify(response_data)
+        if job_id not in JOBS:
+            return jsonify({"message": "Unknown job."}), 404
+    if not _event_stream_slots.acquire(blocking=False):
+        return (jsonify({"message": "Too many open event streams; poll /status instead."}), 503,
+                {'Retry-After': str(EVENT_STREAM_RETRY_SECONDS)})
+    subscriber = EVENTS.subscribe(job_id)
+
+    def stream():
+        try:
+            with status_lock:
+                job = JOBS.get(job_id)
+                if job is None:
+                    return
+                summary = _job_summary(job)
+                results = [dict(item) for item in job['results'].values()]
+            yield _format_event('snapshot', dict(summary, results=results))
+            # The job's log so far, then whatever is added while the stream is open
+            logs = _read_job_logs(subscriber)
+            if logs:
+                yield _format_event('logs', logs)
+            while summary['status'] not in ('finished', 'error'):
+                if subscriber.wakeup.wait(EVENT_KEEPALIVE_SECONDS):
+                    time.sleep(EVENT_COALESCE_SECONDS)
+                dirty_items, job_dirty = EVENTS.drain(subscriber)
+                logs = _read_job_logs(subscriber)
+                if logs:
+                    yield _format_event('logs', logs)
+                if not dirty_items and not job_dirty:
+                    if not logs:
+                        yield ": keepalive\n\n"
+                    continue
+                with status_lock:
+                    job = JOBS.get(job_id)
+                    if job is None:
+                        return
+                    summary = _job_summary(job)
+                    items = [dict(job['results'][video_id]) for video_id in dirty_items if video_id in job['results']]
+                yield _format_event('items', {'job': summary, 'items': items})
+            logs = _read_job_logs(subscriber)
+            if logs:
+                yield _format_event('logs', logs)
+            yield _format_event('done', summary)
+        finally:
+            EVENTS.unsubscribe(subscriber)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Called by the server once the response is done, also when the stream never started
+    response.call_on_close(_event_stream_slots.release)
+    return response
+
+@app.route("/jobs")
+def list_jobs():
+    with status_lock:
+        jobs = [_job_summary(job) for job in JOBS.values()]
+    return jsonify({
+        "jobs": jobs,
+        "queued_items": DOWNLOAD_QUEUE.qsize(),
+        "queued_transcodes": TRANSCODE_QUEUE.qsize(),
+        "pending_retries": RETRY_SCHEDULER.pending,
+        "workers": DOWNLOAD_POOL.size,
+        "ffmpeg_workers": TRANSCODE_POOL.size,
+        "remote_workers": WORK_LEASES.summary() if WORK_LEASES.enabled else None,
+    })
+
+@app.route("/metrics")
+def metrics():
+    """ Counters, histograms and current gauges in the Prometheus text exposition format. """
+    lines = METRICS.render()
+    with status_lock:
+        active_jobs = sum(1 for job in JOBS.values() if job['status'] in ('queued', 'downloading'))
+        pool_stats = dict(POOL_STATS)
+        lock_wait = status_lock.wait_time.render('ytmp3_status_lock_wait_seconds', ())
+        lock_hold = status_lock.hold_time.render('ytmp3_status_lock_hold_seconds', ())
+    pools = (DOWNLOAD_POOL, TRANSCODE_POOL)
+    lines += _metric_family('ytmp3_status_lock_wait_seconds', 'histogram', "Time spent waiting to acquire status_lock.", lock_wait)
+    lines += _metric_family('ytmp3_status_lock_hold_seconds', 'histogram', "Time status_lock was held.", lock_hold)
+    lines += _metric_family('ytmp3_items_total', 'counter', "Tracks that reached a terminal state, by status.", [
+        f'ytmp3_items_total{{status="{status}"}} {pool_stats["items_" + status]}' for status in ('finished', 'failed', 'skipped')
+    ])
+    lines += _metric_family('ytmp3_downloaded_bytes_total', 'counter', "Bytes downloaded by all workers.",
+                            [f"ytmp3_downloaded_bytes_total {pool_stats['bytes_downloaded']}"])
+    lines += _metric_family('ytmp3_throttled_total', 'counter', "Failed or retried download attempts whose error looked like throttling.",
+                            [f"ytmp3_throttled_total {pool_stats['items_throttled']}"])
+    backoff = BACKOFF.summary()
+    lines += _metric_family('ytmp3_throttle_events_total', 'counter', "Throttling incidents that triggered a backoff.",
+                            [f"ytmp3_throttle_events_total {backoff['events']}"])
+    lines += _metric_family('ytmp3_rate_limit_scale', 'gauge', "Fraction of the configured rate limits currently in effect.",
+                            [f"ytmp3_rate_limit_scale {backoff['scale']}"])
+    lines += _metric_family('ytmp3_active_jobs', 'gauge', "Jobs that are queued or downloading.", [f"ytmp3_active_jobs {active_jobs}"])
+    lines += _metric_family('ytmp3_workers', 'gauge', "Configured worker threads per pool.",
+                            [f'ytmp3_workers{{pool="{pool.name}"}} {pool.size}' for pool in pools])
+    lines += _metric_family('ytmp3_workers_busy', 'gauge', "Worker threads currently working on a track.",
+                            [f'ytmp3_workers_busy{{pool="{pool.name}"}} {pool.busy}' for pool in pools])
+    lines += _metric_family('ytmp3_queue_depth', 'gauge', "Tracks waiting in each pool's queue.",
+                            [f'ytmp3_queue_depth{{pool="{pool.name}"}} {pool.queue.qsize()}' for pool in pools])
+    lines += _metric_family('ytmp3_retries_pending', 'gauge', "Failed downloads waiting for their retry.",
+                            [f"ytmp3_retries_pending {RETRY_SCHEDULER.pending}"])
+    if WORK_LEASES.enabled:
+        leases = WORK_LEASES.summary()
+        lines += _metric_family('ytmp3_leases', 'gauge', "Tracks waiting for a remote worker or leased to one.",
+                                [f'ytmp3_leases{{state="{state}"}} {leases[state]}' for state in ('pending', 'leased')])
+        lines += _metric_family('ytmp3_leases_expired_total', 'counter', "Leases reassigned because their worker stopped sending heartbeats.",
+                                [f"ytmp3_leases_expired_total {leases['expired']}"])
+        lines += _metric_family('ytmp3_remote_workers', 'gauge', "Remote workers that called in recently.",
+                                [f"ytmp3_remote_workers {leases['workers']}"])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route("/config", methods=["GET", "POST"])
+def config():
+    """ Read or change the runtime settings, e.g. POST {"workers": 8} or {"adaptive": true}. """
+    if request.method == "POST":
+        try:
+            apply_settings(request.json or {})
+        except (TypeError, ValueError) as e:
+            return jsonify({"message": str(e)}), 400
+    return jsonify(dict(SETTINGS, current_workers=DOWNLOAD_POOL.size, throttle_backoff=BACKOFF.summary()))
+
+def _is_loopback(address):
+    if address == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+@app.before_request
+def _check_network_client():
+    """ When listening beyond loopback, only local clients and token holders may change state. """
+    if not NETWORK_EXPOSED or request.method in ('GET', 'HEAD', 'OPTIONS') or _is_loopback(request.remote_addr):
+        return None
+    if WORKER_TOKEN and hmac.compare_digest(request.headers.get('X-Worker-Token', ''), WORKER_TOKEN):
+        return None
+    return jsonify({"message": "Requests from other machines need the X-Worker-Token header."}), 403
+
+def _worker_request():
+    """ The JSON body of a remote worker's call, or an error response if it may not make it. """
+    if not WORK_LEASES.enabled:
+        return None, (jsonify({"message": "This server does not use remote workers; start it with --remote-workers."}), 404)
+    if WORKER_TOKEN and not hmac.compare_digest(request.headers.get('X-Worker-Token', ''), WORKER_TOKEN):
+        return None, (jsonify({"message": "Invalid worker token."}), 403)
+    data = request.json or {}
+    if not data.get('worker'):
+        return None, (jsonify({"message": "A worker id is required."}), 400)
+    return data, None
+
+@app.route("/worker/lease", methods=["POST"])
+def worker_lease():
+    """ Hand a remote worker up to {"max": n} tracks to download. """
+    data, error = _worker_request()
+    if error:
+        return error
+    count = max(0, min(int(data.get('max') or 1), 100))
+    return jsonify({"leases": WORK_LEASES.lease(data['worker'], count)})
+
+@app.route("/worker/heartbeat", methods=["POST"])
+def worker_heartbeat():
+    """ Renew a worker's leases: {"leases": [{"id", "status", "progress"}, ...]}. Answers with the
+    ids of leases the worker has lost and should stop working on. """
+    data, error = _worker_request()
+    if error:
+        return error
+    try:
+        reports = [dict(report, progress=max(0.0, min(100.0, float(report.get('progress') or 0))))
+                   for report in data.get('leases') or []]
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"message": "leases must be a list of objects with a numeric progress."}), 400
+    return jsonify({"lost": WORK_LEASES.heartbeat(data['worker'], reports)})
+
+@app.route("/worker/complete", methods=["POST"])
+def worker_complete():
+    """ Report a lease's result: {"id", "status": finished|skipped|error, "error", "path", "size", "sha256"}. """
+    data, error = _worker_request()
+    if error:
+        return error
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+        return jsonify({"message": "size must be a non-negative integer."}), 400
+    accepted = WORK_LEASES.complete(data['worker'], data.get('id'), data.get('status'), data.get('error'), data.get('path'),
+                                    size, data.get('sha256'))
+    return jsonify({"accepted": accepted}), 200 if accepted else 409
 
 @app.route("/logs")
 def get_logs():
-    logs = []
-    while not LOG_QUEUE.empty():
-        logs.append(LOG_QUEUE.get_nowait())
-    return jsonify(logs)
+    """ Log lines after a cursor: /logs?after=<seq>&job=<job_id>&level=<min level>&limit=<n>.
 
+    Pass the returned 'cursor' as `after` on the next call. 'missed' counts lines that were
+    dropped from the ring buffer before this reader got to them.
+    """
+    level = request.args.get('level')
+    if level is not None and level not in LOG_LEVELS:
+        return jsonify({"message": f"Unknown log level '{level}'."}), 400
+    lines, cursor, missed = LOG_STORE.read(
+        after=request.args.get('after', 0, type=int),
+        job_id=request.args.get('job'),
+        min_level=level,
+        limit=max(1, min(request.args.get('limit', 1000, type=int), LOG_BUFFER_LINES)),
+    )
+    return jsonify({'logs': lines, 'cursor': cursor, 'missed': missed})
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YT Music Downloader web server")
+    parser.add_argument('--workers', type=int, help="concurrent downloads (default: 4, or YTMP3_WORKERS)")
+    parser.add_argument('--ffmpeg-workers', type=int, help="concurrent ffmpeg conversions (default: CPU count, or YTMP3_FFMPEG_WORKERS)")
+    parser.add_argument('--adaptive', action='store_true', default=None, help="size the download pool automatically")
+    parser.add_argument('--min-workers', type=int, help="lower bound for --adaptive")
+    parser.add_argument('--max-workers', type=int, help="upper bound for --adaptive")
+    parser.add_argument('--max-download-kbps', type=int, help="combined download speed limit in KiB/s, 0 for none (default: 0, or YTMP3_MAX_DOWNLOAD_KBPS)")
+    parser.add_argument('--requests-per-minute', type=int, help="extraction requests per minute per host, 0 for none (default: 60, or YTMP3_REQUESTS_PER_MINUTE)")
+    parser.add_argument('--connections-per-file', type=int, help="connections per MP4 download, taken from the worker budget (default: 1, or YTMP3_CONNECTIONS_PER_FILE)")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), help="lowest level kept in the live log (default: info, or YTMP3_LOG_LEVEL)")
+    parser.add_argument('--output-dir', help="music library folder; playlists get a sub-folder (default: ~/Music/YTMusicDownloader, or YTMP3_OUTPUT_DIR)")
+    parser.add_argument('--scratch-dir', help="folder for partial downloads and conversions, e.g. on tmpfs (default: in the app data folder, or YTMP3_SCRATCH_DIR)")
+    parser.add_argument('--no-resume', action='store_true', help="discard unfinished jobs from the last run instead of resuming them")
+    parser.add_argument('--remote-workers', action='store_true', help="hand downloads to worker processes (ytmp3 worker) instead of downloading here")
+    parser.add_argument('--worker-token', help="secret remote workers and other machines' API clients must present (default: YTMP3_WORKER_TOKEN)")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on; remote workers on other machines need e.g. 0.0.0.0 and a --worker-token")
+    args = parser.parse_args()
+    cli_settings = {name: value for name, value in vars(args).items() if name in SETTINGS and value is not None}
+    try:
+        apply_settings({**_settings_from_env(), **cli_settings})
+    except ValueError as e:
+        parser.error(str(e))
+    WORK_LEASES.enabled = args.remote_workers
+    WORKER_TOKEN = args.worker_token or WORKER_TOKEN
+    NETWORK_EXPOSED = not _is_loopback(args.host)
+    if NETWORK_EXPOSED and not WORKER_TOKEN:
+        parser.error(f"listening on {args.host} needs a --worker-token, or anyone on the network could change settings and start downloads")
+
+    if args.no_resume:
+        JOURNAL.start(truncate=True)
+    else:
+        resumed = resume_journaled_jobs()
+        if resumed:
+            print(f"Resuming {resumed} unfinished job(s) from the last run")
+
     try:
-        music_dir = os.path.expanduser(r'~\Music')
-        base_folder = os.path.join(music_dir, 'YTMusicDownloader')
-        if not os.path.exists(base_folder):
-            os.makedirs(base_folder)
+        os.makedirs(SETTINGS['output_dir'], exist_ok=True)
     except Exception as e:
         print(f"Could not create download directory: {e}")
         
@@ -770,7 +1243,9 @@ if __name__ == "__main__":
         print(f"Created static directory at {STATIC_DIR}")
         print(f"Please place your 'favicon.ico' file in this directory.")
     
-    print("Starting server at http://127.0.0.1:5000")
+    print(f"Starting server at http://{args.host}:5000")
+    if args.remote_workers:
+        print("Waiting for remote workers: python ytmp3.py worker http://<this host>:5000")
     
     def open_browser():
         if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -778,4 +1253,4 @@ if __name__ == "__main__":
         
     open_browser()
     
-    serve(app, host='127.0.0.1', port=5000)
+    serve(app, host=args.host, port=5000, threads=SERVER_THREADS)
@@ -0,0 +1,153 @@
+"""
+Headless batch mode: download playlists and videos with the same engine as the web server,
+but without Flask or waitress.
+
+    python ytmp3.py download <url|file-of-urls>... [--format mp3] [--workers 4] [--out DIR]
+
+Every URL becomes one job; all of them share one worker pool. Progress goes to stdout as JSON
+lines ({"event": "item", ...}). The exit code is 0 when every track was downloaded (or already
+was), 1 when any URL or track failed, 2 for usage errors and 130 when interrupted.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from ytmp3_engine import (
+    JOURNAL, LOG_LEVELS, LOG_STORE, SETTINGS, apply_settings, create_job,
+    download_songs_task, get_format_options, start_listing, status_lock, _settings_from_env,
+)
+
+# How often the job states are checked for changes to report
+PROGRESS_INTERVAL = 0.5
+
+
+def emit(event, **fields):
+    sys.stdout.write(json.dumps({'event': event, 'time': round(time.time(), 3), **fields}) + '\n')
+    sys.stdout.flush()
+
+
+def read_sources(sources):
+    """ URLs from the command line; arguments naming a file add the URLs in it, one per line (# comments). """
+    urls = []
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source, 'r', encoding='utf-8') as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith('#'))
+        else:
+            urls.append(source)
+    # The same URL twice would only download the same songs twice
+    return list(dict.fromkeys(urls))
+
+
+def _item_event(job, item):
+    fields = {'job_id': job['id'], 'id': item['id'], 'title': item['title'], 'status': item['status'],
+              'progress': round(item['progress'], 1)}
+    if item['status'] in ('error', 'retrying'):
+        fields['error'] = item.get('error_message')
+    return fields
+
+
+def _job_counts(job):
+    return {'total': job['total_items'], 'downloaded': job['downloaded_items'],
+            'failed': job['failed_items'], 'skipped': job['skipped_items']}
+
+
+def run(urls, args):
+    """ List every URL, queue each listing as a job as soon as it is ready and report until all
+    jobs are done. Returns the number of URLs and tracks that failed. """
+    listings = {url: start_listing(url, refresh=args.refresh, fast=args.fast) for url in urls}
+    jobs = []         # job dicts; kept here because finished jobs may be pruned from JOBS
+    revisions = {}    # job id -> last revision reported
+    log_cursor = 0
+    failures = 0
+    while listings or any(job['id'] in revisions for job in jobs):
+        for url, listing in list(listings.items()):
+            page = listing.page(0, None, 0)
+            if not page['done']:
+                continue
+            del listings[url]
+            if page['error'] or not page['songs']:
+                failures += 1
+                emit('listing_failed', url=url, error=page['error'] or "Nothing to download.")
+                continue
+            job = create_job(page['songs'], page['playlist_title'], args.format, page['is_playlist'])
+            jobs.append(job)
+            revisions[job['id']] = 0
+            emit('job', job_id=job['id'], url=url, title=page['playlist_title'], tracks=len(page['songs']))
+            download_songs_task(job['id'], page['songs'], page['playlist_title'], args.format, page['is_playlist'], args.out)
+
+        # Copy what changed under the lock, write it out after releasing it
+        events = []
+        with status_lock:
+            for job in jobs:
+                since = revisions.get(job['id'])
+                if since is None or job['revision'] == since:
+                    continue
+                events.extend(('item', _item_event(job, item)) for item in job['results'].values() if item['revision'] > since)
+                revisions[job['id']] = job['revision']
+                if job['status'] in ('finished', 'error'):
+                    del revisions[job['id']]
+                    events.append(('job_done', dict(_job_counts(job), job_id=job['id'], status=job['status'],
+                                                    error=job.get('error_message'))))
+        lines, log_cursor, _ = LOG_STORE.read(after=log_cursor)
+        for line in lines:
+            emit('log', level=line['level'], job_id=line['job_id'], message=line['message'])
+        for event, fields in events:
+            emit(event, **fields)
+        time.sleep(PROGRESS_INTERVAL)
+
+    totals = {'total': 0, 'downloaded': 0, 'failed': 0, 'skipped': 0}
+    for job in jobs:
+        for key, value in _job_counts(job).items():
+            totals[key] += value
+        if job['status'] == 'error':
+            failures += 1
+    failures += totals['failed']
+    emit('summary', urls=len(urls), jobs=len(jobs), **totals)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ytmp3', description="YT Music Downloader batch mode")
+    commands = parser.add_subparsers(dest='command', required=True)
+    download = commands.add_parser('download', help="download playlists and videos, reporting progress as JSON lines")
+    download.add_argument('sources', nargs='+', metavar='URL|FILE', help="playlist/video URLs, or files listing them one per line")
+    download.add_argument('--format', default='mp3', help="output profile: mp3, mp3-<kbps>, mp3-v<0-9>, m4a, opus, original or mp4 (default: mp3)")
+    download.add_argument('--out', help="library folder; playlists get a sub-folder (default: ~/Music/YTMusicDownloader, or YTMP3_OUTPUT_DIR)")
+    download.add_argument('--scratch-dir', help="folder for partial downloads and conversions, e.g. on tmpfs (default: in the app data folder, or YTMP3_SCRATCH_DIR)")
+    download.add_argument('--fast', action='store_true', help="list playlists with a flat extraction (faster for huge playlists)")
+    download.add_argument('--refresh', action='store_true', help="ignore cached playlist metadata")
+    download.add_argument('--workers', type=int, help="concurrent downloads (default: 4, or YTMP3_WORKERS)")
+    download.add_argument('--ffmpeg-workers', type=int, help="concurrent ffmpeg conversions (default: CPU count, or YTMP3_FFMPEG_WORKERS)")
+    download.add_argument('--max-download-kbps', type=int, help="combined download speed limit in KiB/s, 0 for none")
+    download.add_argument('--requests-per-minute', type=int, help="extraction requests per minute per host, 0 for none")
+    download.add_argument('--connections-per-file', type=int, help="connections per MP4 download, taken from the worker budget")
+    download.add_argument('--log-level', choices=list(LOG_LEVELS), help="lowest level of log lines to report (default: info, or YTMP3_LOG_LEVEL)")
+    args = parser.parse_args(argv)
+
+    try:
+        get_format_options(args.format)
+        cli_settings = {name: value for name, value in vars(args).items() if name in SETTINGS and value is not None}
+        apply_settings({**_settings_from_env(), **cli_settings})
+    except ValueError as e:
+        download.error(str(e))
+    urls = read_sources(args.sources)
+    if not urls:
+        download.error("no URLs given")
+    if args.out:
+        args.out = os.path.abspath(os.path.expanduser(args.out))
+
+    # Nothing resumes batch jobs, so journaling them would only cost an fsync per batch of items
+    JOURNAL.enabled = False
+    try:
+        failures = run(urls, args)
+    except KeyboardInterrupt:
+        emit('interrupted')
+        return 130
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
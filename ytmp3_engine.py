@@ -0,0 +1,2314 @@
+"""
+The download engine behind both front ends: jobs, the worker pools, caches, rate limiting and
+logging. It must not import Flask or waitress, so the headless CLI (ytmp3_cli) starts quickly;
+the web server (ytmp3) adds the routes and the page on top.
+"""
+import yt_dlp
+from yt_dlp.postprocessor import FFmpegMergerPP, FFmpegPostProcessor
+import threading
+import json
+import os
+import queue
+import concurrent.futures
+import re
+import time
+import uuid
+from collections import deque
+import sys
+import itertools
+import contextlib
+import errno
+import shutil
+import sqlite3
+import hashlib
+import atexit
+import bisect
+import heapq
+import random
+from urllib.parse import urlsplit
+
+# --- Configuration ---
+
+def get_base_path():
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    else:
+        # Not bundled, just running as a .py script
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return base_path
+
+# ### MODIFICATION ###: This now points to the DIRECTORY where ffmpeg.exe and ffprobe.exe live
+FFMPEG_PATH = get_base_path() 
+
+# Where caches and other app state live (not the music library itself)
+DATA_DIR = os.environ.get('YTMP3_DATA_DIR') or os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.local', 'share'),
+    'YTMusicDownloader'
+)
+
+# --- Metrics (served at /metrics in the Prometheus text format) ---
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+LOCK_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1)
+SIZE_BUCKETS = (256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+
+class Histogram:
+    """ Bucketed distribution of observed values. Not thread-safe by itself. """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _metric_family(name, kind, description, samples):
+    return [f"# HELP {name} {description}", f"# TYPE {name} {kind}"] + samples
+
+class Metrics:
+    """ Registry of labelled counters and histograms. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+        self._series = {}
+
+    def counter(self, name, description):
+        self._families[name] = ('counter', description, None)
+        self._series[name] = {}
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        self._families[name] = ('histogram', description, buckets)
+        self._series[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._families[name][2])
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, description, _) in self._families.items():
+                samples = []
+                for labels, value in self._series[name].items():
+                    if kind == 'histogram':
+                        samples.extend(value.render(name, labels))
+                    else:
+                        samples.append(f"{name}{_format_labels(labels)} {value}")
+                lines += _metric_family(name, kind, description, samples)
+        return lines
+
+METRICS = Metrics()
+METRICS.histogram('ytmp3_extraction_seconds', "Time to extract playlist/video info, by kind (playlist, listing).")
+METRICS.histogram('ytmp3_download_seconds', "Time to download one track, excluding queue wait and transcoding.")
+METRICS.histogram('ytmp3_track_bytes', "Size of each downloaded track.", SIZE_BUCKETS)
+METRICS.histogram('ytmp3_postprocess_seconds', "Time spent in each yt-dlp/ffmpeg postprocessor.")
+METRICS.histogram('ytmp3_queue_wait_seconds', "Time a track waited in a pool queue before a worker picked it up.")
+METRICS.counter('ytmp3_progress_updates_total', "progress_hook calls, by whether the update was published or throttled away.")
+METRICS.counter('ytmp3_failures_total', "Failed tracks and extractions, by stage and error class.")
+METRICS.counter('ytmp3_retries_total', "Downloads re-queued for another attempt, by error class.")
+
+class InstrumentedLock:
+    """ A Lock that records how long callers waited for it and how long they held it.
+
+    The histograms are only updated while the lock is held, so they need no lock of their own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.wait_time = Histogram(LOCK_BUCKETS)
+        self.hold_time = Histogram(LOCK_BUCKETS)
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self.wait_time.observe(self._acquired_at - started)
+        return acquired
+
+    def release(self):
+        self.hold_time.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+# Rough error classes used to label failures, e.g. to tell throttling apart from dead videos
+ERROR_CLASSES = (
+    ('throttled', re.compile(r'HTTP Error 429|Too Many Requests|rate.?limit|throttl', re.IGNORECASE)),
+    ('unavailable', re.compile(r'Video unavailable|Private video|has been removed|copyright|members.only|age.?restrict|Sign in to confirm', re.IGNORECASE)),
+    ('geo_blocked', re.compile(r'not (?:be )?available in your country|geo.?restrict', re.IGNORECASE)),
+    ('network', re.compile(r'timed? ?out|Connection|Temporary failure|HTTP Error 5\d\d|IncompleteRead|reset by peer', re.IGNORECASE)),
+    ('ffmpeg', re.compile(r'ffmpeg|ffprobe|Postprocessing|Conversion failed', re.IGNORECASE)),
+)
+
+def classify_error(message):
+    for name, pattern in ERROR_CLASSES:
+        if pattern.search(message or ''):
+            return name
+    return 'other'
+
+
+# In-memory registry of download jobs (job_id -> job dict) and a lock for thread-safe updates.
+# Every /download call creates a new job; all jobs share the same pool of download workers.
+JOBS = {}
+status_lock = InstrumentedLock()
+
+# Finished jobs are kept around for /jobs and /status, but only the most recent ones
+MAX_FINISHED_JOBS = 50
+
+# yt-dlp calls progress_hook for every downloaded chunk. A new value is only published to the
+# shared job state once both this much time and this many percentage points have passed.
+PROGRESS_MIN_INTERVAL = 0.25
+PROGRESS_MIN_DELTA = 0.5
+
+# Runtime settings. Defaults can be overridden by YTMP3_<NAME> environment variables
+# (e.g. YTMP3_WORKERS=8), by command line flags, or while running through POST /config.
+SETTINGS = {
+    # Concurrent downloads (network bound). In adaptive mode this is only the starting size.
+    'workers': 4,
+    # Concurrent ffmpeg postprocessing (CPU bound), capped independently of the downloads
+    'ffmpeg_workers': os.cpu_count() or 4,
+    # Grow/shrink the download pool between min_workers and max_workers from observed throughput and errors
+    'adaptive': False,
+    'min_workers': 1,
+    'max_workers': 16,
+    # Extraction results are reused for this many seconds. Kept well below the ~6h lifetime
+    # of YouTube stream URLs, because cached video info is also used to start downloads.
+    'metadata_ttl': 3600,
+    # Size limit of the on-disk metadata cache; least recently used entries are evicted first
+    'metadata_cache_mb': 256,
+    # Log lines below this level (debug, info, warning, error) are dropped before they are stored
+    'log_level': 'info',
+    # Combined download speed of all workers in KiB/s (0 = unlimited)
+    'max_download_kbps': 0,
+    # Extraction requests per minute to any one host, shared by all workers (0 = unlimited)
+    'requests_per_minute': 60,
+    # Connections one MP4 download may use: its video and audio streams are fetched at the same time,
+    # each with concurrent fragments. Every connection takes a download worker slot.
+    'connections_per_file': 1,
+    # Artwork is scaled down to fit this many pixels (width and height) before it is embedded
+    'thumbnail_max_size': 720,
+    # Size limit of the on-disk thumbnail cache; least recently used images are evicted first
+    'thumbnail_cache_mb': 100,
+    # The music library; playlists get a sub-folder. Only finished files are ever written here.
+    'output_dir': os.path.join(os.path.expanduser('~'), 'Music', 'YTMusicDownloader'),
+    # Where partial downloads and ffmpeg temporaries live until a track is finished, ideally a fast
+    # local disk or tmpfs ('' = a folder in DATA_DIR)
+    'scratch_dir': '',
+}
+SETTING_TYPES = {
+    'workers': int,
+    'ffmpeg_workers': int,
+    'adaptive': bool,
+    'min_workers': int,
+    'max_workers': int,
+    'metadata_ttl': int,
+    'metadata_cache_mb': int,
+    'log_level': str,
+    'max_download_kbps': int,
+    'requests_per_minute': int,
+    'connections_per_file': int,
+    'thumbnail_max_size': int,
+    'thumbnail_cache_mb': int,
+    'output_dir': str,
+    'scratch_dir': str,
+}
+# Settings where 0 means "no limit"
+UNLIMITED_SETTINGS = {'max_download_kbps', 'requests_per_minute'}
+
+# Adaptive mode re-evaluates the pool size this often, and halves it when more than
+# ADAPTIVE_MAX_ERROR_RATE of the finished items failed or any of them were throttled
+ADAPTIVE_INTERVAL = 10
+ADAPTIVE_MAX_ERROR_RATE = 0.25
+THROTTLE_PATTERN = dict(ERROR_CLASSES)['throttled']
+
+# When throttling is detected, new extraction requests pause for THROTTLE_PAUSE seconds (doubling
+# on repeated throttling, up to THROTTLE_MAX_PAUSE) and the rate limits are halved, down to
+# THROTTLE_MIN_SCALE of their configured value. Every THROTTLE_RECOVERY_INTERVAL seconds without
+# throttling gives back THROTTLE_RECOVERY_STEP of the configured rate.
+THROTTLE_PAUSE = 5
+THROTTLE_MAX_PAUSE = 120
+THROTTLE_MIN_SCALE = 0.1
+THROTTLE_RECOVERY_INTERVAL = 30
+THROTTLE_RECOVERY_STEP = 0.1
+
+# Failed downloads are re-queued after an exponential backoff with jitter instead of yt-dlp
+# retrying inline (which keeps the worker busy). Allowed retries per error class; classes not
+# listed here (unavailable, geo_blocked, ffmpeg) are permanent and fail right away.
+RETRY_POLICY = {'network': 4, 'throttled': 4, 'other': 1}
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 120
+
+# Extractions run on a small dedicated executor rather than in waitress threads. /fetch_playlist
+# answers right away with a listing handle; the client pages through it (long-polling with ?wait=)
+# while the songs come in. Fast (flat) listings fill in page by page, full ones all at once.
+EXTRACTION_WORKERS = 4
+LISTING_PAGE_SIZE = 100
+LISTING_WAIT_SECONDS = 60
+MAX_LISTINGS = 20
+
+# With remote workers, a coordinator leases download work to worker processes (ytmp3_worker).
+# A lease that is not renewed by a heartbeat within LEASE_SECONDS goes back to the queue for
+# another worker; an item whose leases expired LEASE_MAX_EXPIRIES times fails.
+LEASE_SECONDS = 60
+LEASE_MAX_EXPIRIES = 3
+WORKER_SEEN_SECONDS = 120
+
+# Two-stage pipeline: the download pool only does network I/O and hands finished downloads to
+# the transcode pool (ffmpeg conversion + thumbnail embedding) through a bounded queue, so slow
+# encodes never hold a network slot. Items are (job_id, song, download_context, ...) tuples.
+DOWNLOAD_QUEUE = queue.Queue()
+TRANSCODE_QUEUE = queue.Queue(maxsize=64)
+_autoscaler_thread = None
+
+# Totals since startup, read by the adaptive pool controller. Protected by status_lock.
+POOL_STATS = {'bytes_downloaded': 0, 'items_finished': 0, 'items_failed': 0, 'items_skipped': 0, 'items_throttled': 0}
+
+# Job/item state transitions are appended to a journal in DATA_DIR and fsynced in batches at
+# most this often, so unfinished jobs can be resumed after a restart
+JOURNAL_FSYNC_INTERVAL = 0.2
+
+# Finished tracks are listed in a manifest and an M3U playlist in their folder, written by a
+# background thread in batches at most this often
+MANIFEST_FLUSH_INTERVAL = 2.0
+MANIFEST_FILE = 'manifest.jsonl'
+PLAYLIST_FILE = 'playlist.m3u8'
+
+# The live log is a ring buffer of the most recent lines, read with /logs?after=<seq> cursors
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_BUFFER_LINES = 5000
+
+
+class EventSubscriber:
+    """ One connected /events client: the set of changed items it has not seen yet, plus its log cursor. """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.dirty_items = set()
+        self.job_dirty = False
+        self.log_cursor = 0
+        self.wakeup = threading.Event()
+
+
+class EventBroker:
+    """ Fans out item changes and new-log notifications to the connected /events streams.
+
+    Publishing only records *which* items changed; the stream reads their current
+    state when it flushes, so any number of progress updates in between cost nothing extra.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, job_id):
+        subscriber = EventSubscriber(job_id)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish_change(self, job_id, video_id=None):
+        if not self._subscribers:
+            return
+        with self._lock:
+            for subscriber in self._subscribers:
+                if subscriber.job_id == job_id:
+                    if video_id is None:
+                        subscriber.job_dirty = True
+                    else:
+                        subscriber.dirty_items.add(video_id)
+                    subscriber.wakeup.set()
+
+    def publish_log(self, job_id):
+        """ Wake the streams of a job that got new log lines; they read them from LOG_STORE themselves. """
+        if not self._subscribers or job_id is None:
+            return
+        with self._lock:
+            for subscriber in self._subscribers:
+                if subscriber.job_id == job_id:
+                    subscriber.wakeup.set()
+
+    def drain(self, subscriber):
+        """ Take everything pending for a subscriber: (changed item ids, job changed). """
+        with self._lock:
+            subscriber.wakeup.clear()
+            dirty_items, subscriber.dirty_items = subscriber.dirty_items, set()
+            job_dirty, subscriber.job_dirty = subscriber.job_dirty, False
+        return dirty_items, job_dirty
+
+
+EVENTS = EventBroker()
+
+
+class LogStore:
+    """ The most recent log lines in a fixed-size ring buffer, each with an increasing sequence number.
+
+    Reading never consumes anything: every reader keeps its own cursor (the last sequence number
+    it has seen) and asks for the lines after it, so any number of viewers see every line.
+    """
+    def __init__(self, capacity):
+        self._entries = deque(maxlen=capacity)
+        self._last_seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, level, message, job_id):
+        with self._lock:
+            self._last_seq += 1
+            self._entries.append((self._last_seq, time.time(), level, job_id, message))
+
+    def read(self, after=0, job_id=None, min_level=None, limit=1000):
+        """ Lines with seq > after, optionally only those of one job and at least min_level.
+
+        Returns the matching lines, the cursor to pass as `after` next time, and how many lines
+        the reader missed because they were pushed out of the buffer before it asked.
+        """
+        with self._lock:
+            if not self._entries:
+                return [], self._last_seq, 0
+            first_seq = self._entries[0][0]
+            entries = list(itertools.islice(self._entries, max(0, after + 1 - first_seq), None))
+            cursor = self._last_seq
+        threshold = LOG_LEVELS.get(min_level, 0)
+        lines = []
+        for seq, logged_at, level, entry_job_id, message in entries:
+            if job_id is not None and entry_job_id != job_id:
+                continue
+            if LOG_LEVELS[level] < threshold:
+                continue
+            if len(lines) >= limit:
+                cursor = lines[-1]['seq']
+                break
+            lines.append({'seq': seq, 'time': logged_at, 'level': level, 'job_id': entry_job_id, 'message': message})
+        return lines, cursor, max(0, first_seq - after - 1) if after else 0
+
+
+LOG_STORE = LogStore(LOG_BUFFER_LINES)
+
+# Job the current worker thread is working on, so log lines can be attributed to it
+_log_context = threading.local()
+
+
+def log_enabled(level):
+    return LOG_LEVELS[level] >= LOG_LEVELS[SETTINGS['log_level']]
+
+
+def log_message(msg, level='info', job_id=None):
+    """ Add a line to the live log, tagged with the current worker's job unless job_id is given. """
+    if not log_enabled(level):
+        return
+    if job_id is None:
+        job_id = getattr(_log_context, 'job_id', None)
+    LOG_STORE.append(level, msg, job_id)
+    EVENTS.publish_log(job_id)
+
+# --- Helper functions for download process ---
+def sanitize_filename(name):
+    return re.sub(r'[\\/*?:"<>|]', "", name)
+
+# Audio profiles that never re-encode: yt-dlp's ExtractAudio stream-copies when the source codec
+# already matches ('best' keeps whatever the source is and only remuxes it)
+STREAM_COPY_PROFILES = {
+    'm4a': ('bestaudio[ext=m4a]/bestaudio/best', 'm4a'),
+    'opus': ('bestaudio[acodec=opus]/bestaudio/best', 'opus'),
+    'original': ('bestaudio/best', 'best'),
+}
+# The artwork comes from THUMBNAIL_CACHE, which must keep its file
+EMBED_CACHED_THUMBNAIL = {'key': 'EmbedThumbnail', 'already_have_thumbnail': True}
+MP3_PROFILE = re.compile(r'mp3(?:-(?:(\d{2,3})|v(\d)))?')
+
+def get_format_options(format_type):
+    """ yt-dlp options for an output profile. Raises ValueError for unknown profiles.
+
+    'mp3' (320 kbps), 'mp3-<kbps>' or 'mp3-v<0-9>' (VBR) re-encode to MP3; 'm4a', 'opus' and
+    'original' copy the audio stream without re-encoding (if the source codec does not match,
+    m4a/opus fall back to a conversion); 'mp4' is video.
+    """
+    mp3 = MP3_PROFILE.fullmatch(format_type)
+    if mp3:
+        bitrate, vbr = mp3.groups()
+        if bitrate and not 32 <= int(bitrate) <= 320:
+            raise ValueError(f"MP3 bitrate must be between 32 and 320 kbps, not {bitrate}.")
+        return {
+            # Plain 'mp3' keeps its original name in the download index
+            'profile': format_type if format_type != 'mp3' else 'mp3-320',
+            'format': 'bestaudio/best',
+            'postprocessors': [
+                # yt-dlp treats qualities up to 10 as VBR levels and anything above as kbps
+                {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': vbr or bitrate or '320'},
+                EMBED_CACHED_THUMBNAIL,
+            ]
+        }
+    if format_type in STREAM_COPY_PROFILES:
+        format_selector, codec = STREAM_COPY_PROFILES[format_type]
+        return {
+            'profile': format_type,
+            'format': format_selector,
+            'postprocessors': [
+                {'key': 'FFmpegExtractAudio', 'preferredcodec': codec},
+                EMBED_CACHED_THUMBNAIL,
+            ]
+        }
+    if format_type == 'mp4':
+        return {
+            'profile': 'mp4',
+            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+            'postprocessors': [
+                EMBED_CACHED_THUMBNAIL,
+                {'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'},
+            ]
+        }
+    raise ValueError(f"Unknown format '{format_type}'.")
+
+class MetadataCache:
+    """ On-disk (SQLite) cache of yt-dlp extraction results with a TTL and LRU eviction.
+
+    Keys are 'playlist:<url>' for the song list /fetch_playlist returns and 'video:<id>' for
+    the full info of single videos, which the download stage feeds straight back into yt-dlp.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        return self._db
+
+    def get(self, key, max_age):
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT value, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            if time.time() - row[1] > max_age:
+                self.stats['expired'] += 1
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                db.commit()
+                return None
+            self.stats['hits'] += 1
+            db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+        return json.loads(row[0])
+
+    def put_many(self, items):
+        """ Store an iterable of (key, value) pairs in one transaction, then evict down to the size limit. """
+        now = time.time()
+        rows = []
+        for key, value in items:
+            encoded = json.dumps(value)
+            rows.append((key, encoded, len(encoded), now, now))
+        with self._lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self._evict(db)
+            db.commit()
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def _evict(self, db):
+        max_bytes = SETTINGS['metadata_cache_mb'] * 1024 * 1024
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.stats['evicted'] += 1
+            total -= size
+            if total <= max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM entries")
+            db.commit()
+
+    def summary(self):
+        with self._lock:
+            entries, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            return dict(self.stats, entries=entries, bytes=total, max_bytes=SETTINGS['metadata_cache_mb'] * 1024 * 1024)
+
+METADATA_CACHE = MetadataCache(os.path.join(DATA_DIR, 'metadata.sqlite'))
+
+class ThumbnailCache:
+    """ Content-addressed on-disk cache of artwork, ready to embed.
+
+    Each thumbnail URL is fetched once; the image is stored under the hash of its bytes, so
+    tracks whose URLs serve identical artwork (typically an album) share one file, and it is
+    converted to a JPEG no larger than thumbnail_max_size only once. That replaces yt-dlp's
+    per-track thumbnail download and the ffmpeg conversion EmbedThumbnail does for WebP images.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = {'hits': 0, 'fetches': 0, 'conversions': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._db = None
+        # URL -> Event, so concurrent requests for the same image fetch it only once
+        self._inflight = {}
+        # Image name -> tracks that got it from get() and have not embedded it yet; never evicted
+        self._in_use = {}
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.directory, 'thumbnails.sqlite'), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT NOT NULL, max_size INTEGER NOT NULL, "
+                             "name TEXT NOT NULL, PRIMARY KEY (url, max_size))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                             "accessed_at REAL NOT NULL)")
+        return self._db
+
+    def _lookup(self, url, max_size):
+        """ Path of the cached image for url, or None. Must be called with self._lock held. """
+        db = self._connect()
+        row = db.execute("SELECT name FROM urls WHERE url = ? AND max_size = ?", (url, max_size)).fetchone()
+        if row is None:
+            return None
+        path = os.path.join(self.directory, row[0])
+        if not os.path.exists(path):
+            db.execute("DELETE FROM images WHERE name = ?", (row[0],))
+            db.commit()
+            return None
+        db.execute("UPDATE images SET accessed_at = ? WHERE name = ?", (time.time(), row[0]))
+        db.commit()
+        return path
+
+    def get(self, ydl, url):
+        """ Path of a JPEG of the image at url, fetching and converting it if needed. `ydl` is
+        used for the request (cookies, proxy) and to run ffmpeg. The image is kept until the
+        caller hands the path back to release(). """
+        max_size = SETTINGS['thumbnail_max_size']
+        while True:
+            with self._lock:
+                path = self._lookup(url, max_size)
+                if path is not None:
+                    self.stats['hits'] += 1
+                    self._acquire(os.path.basename(path))
+                    return path
+                inflight = self._inflight.get(url)
+                if inflight is None:
+                    inflight = self._inflight[url] = threading.Event()
+                    break
+            inflight.wait()
+        try:
+            return self._fetch(ydl, url, max_size)
+        finally:
+            with self._lock:
+                del self._inflight[url]
+            inflight.set()
+
+    def _fetch(self, ydl, url, max_size):
+        with contextlib.closing(ydl.urlopen(url)) as response:
+            data = response.read()
+        name = f"{hashlib.sha256(data).hexdigest()[:40]}-{max_size}.jpg"
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            self.stats['fetches'] += 1
+        if not os.path.exists(path):
+            # Different URLs can serve the same image, so their conversions may run at the same
+            # time; each one works on its own files and the last rename wins
+            temp = f"{path}.{uuid.uuid4().hex[:8]}"
+            source = f"{temp}.source"
+            converted = f"{temp}.part.jpg"
+            try:
+                with open(source, 'wb') as f:
+                    f.write(data)
+                scale = f"scale=w='min(iw,{max_size})':h='min(ih,{max_size})':force_original_aspect_ratio=decrease"
+                FFmpegPostProcessor(ydl).real_run_ffmpeg([(source, [])], [(converted, ['-vf', scale, '-q:v', '2'])])
+                os.replace(converted, path)
+            finally:
+                for leftover in (source, converted):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            with self._lock:
+                self.stats['conversions'] += 1
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)", (url, max_size, name))
+            db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (name, os.path.getsize(path), time.time()))
+            self._acquire(name)
+            self._evict(db)
+            db.commit()
+        return path
+
+    def _acquire(self, name):
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+
+    def release(self, path):
+        """ The track that got `path` from get() is done with it. """
+        name = os.path.basename(path)
+        with self._lock:
+            if self._in_use.get(name, 0) > 1:
+                self._in_use[name] -= 1
+            else:
+                self._in_use.pop(name, None)
+
+    def _evict(self, db):
+        max_bytes = SETTINGS['thumbnail_cache_mb'] * 1024 * 1024
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+        for name, size in db.execute("SELECT name, size FROM images ORDER BY accessed_at").fetchall():
+            if total <= max_bytes:
+                break
+            if name in self._in_use:
+                continue
+            db.execute("DELETE FROM images WHERE name = ?", (name,))
+            db.execute("DELETE FROM urls WHERE name = ?", (name,))
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(self.directory, name))
+            self.stats['evicted'] += 1
+            total -= size
+
+    def summary(self):
+        with self._lock:
+            images, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+            return dict(self.stats, images=images, bytes=total, max_bytes=SETTINGS['thumbnail_cache_mb'] * 1024 * 1024)
+
+THUMBNAIL_CACHE = ThumbnailCache(os.path.join(DATA_DIR, 'thumbnails'))
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """ SHA-256 of a file, read in chunks. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def folder_key(folder):
+    """ A folder path normalized for comparisons (absolute; case-insensitive on Windows). """
+    return os.path.normcase(os.path.abspath(folder))
+
+class DownloadIndex:
+    """ On-disk (SQLite) index of finished downloads, keyed by video id, format profile and folder.
+
+    Each row records where the output file was written, its size and its SHA-256, so a job can
+    tell which tracks are already on disk without touching the network. It replaces scanning
+    the append-only downloaded.txt, which only held titles. A track that is in several
+    playlists has a row for each playlist folder.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = self._db = sqlite3.connect(self.path, check_same_thread=False)
+            columns = [row[1] for row in db.execute("PRAGMA table_info(downloads)")]
+            # Indexes written before tracks were indexed per folder had one row per video and profile
+            migrate = bool(columns) and 'folder' not in columns
+            if migrate:
+                db.execute("ALTER TABLE downloads RENAME TO downloads_by_video")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                "video_id TEXT NOT NULL, profile TEXT NOT NULL, folder TEXT NOT NULL, path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, sha256 TEXT NOT NULL, downloaded_at REAL NOT NULL, "
+                "PRIMARY KEY (video_id, profile, folder))"
+            )
+            if migrate:
+                rows = db.execute("SELECT video_id, profile, path, size, sha256, downloaded_at FROM downloads_by_video").fetchall()
+                db.executemany("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(video_id, profile, folder_key(os.path.dirname(path)), path, size, sha256, downloaded_at)
+                                for video_id, profile, path, size, sha256, downloaded_at in rows])
+                db.execute("DROP TABLE downloads_by_video")
+                db.commit()
+        return self._db
+
+    def lookup_many(self, video_ids, profile, folder):
+        """ Return {video_id: row} for the ids that have an entry for this profile in `folder`. """
+        found = {}
+        video_ids = list(video_ids)
+        with self._lock:
+            db = self._connect()
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(video_ids), 500):
+                chunk = video_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = db.execute(
+                    f"SELECT video_id, path, size, sha256, downloaded_at FROM downloads "
+                    f"WHERE profile = ? AND folder = ? AND video_id IN ({placeholders})", [profile, folder_key(folder)] + chunk
+                ).fetchall()
+                for video_id, path, size, sha256, downloaded_at in rows:
+                    found[video_id] = {'path': path, 'size': size, 'sha256': sha256, 'downloaded_at': downloaded_at}
+        return found
+
+    def record(self, video_id, profile, path, size=None, sha256=None, folder=None):
+        """ Store a finished output file, hashing it unless `size` and `sha256` are given (e.g.
+        reported by a remote worker, which also gives the coordinator's `folder` the file is for).
+        Runs off status_lock. """
+        if size is None or sha256 is None:
+            size = os.path.getsize(path)
+            sha256 = file_checksum(path)
+        with self._lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (video_id, profile, folder_key(folder or os.path.dirname(path)), path, size, sha256, time.time()))
+            db.commit()
+
+    def summary(self):
+        with self._lock:
+            entries, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM downloads").fetchone()
+            return {'entries': entries, 'bytes': total}
+
+DOWNLOAD_INDEX = DownloadIndex(os.path.join(DATA_DIR, 'downloads.sqlite'))
+
+class JobJournal:
+    """ Append-only JSON-lines write-ahead log of job and item state transitions.
+
+    Records are queued by append(), which is cheap enough to call with status_lock held, and
+    written by a background thread that fsyncs once per batch instead of once per record.
+    Records are {'event': 'job', ...} when a job is created, {'event': 'item', ...} when an
+    item reaches a terminal state and {'event': 'job_done', ...} when a job ends.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Off in remote workers, whose jobs the coordinator journals
+        self.enabled = True
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def read(self):
+        """ All records written so far. A torn last line from a crash is ignored. """
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+    def start(self, truncate=False, records=None):
+        """ Open the journal and start the writer thread. truncate=True starts a fresh file, and
+        `records` a file holding just those records (the state replayed from the old one). The new
+        file is fsynced before it replaces the old one, so a crash leaves one of them intact.
+        """
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if truncate or records is not None:
+                staging = self.path + '.tmp'
+                with open(staging, 'w', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in records or ()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(staging, self.path)
+            journal_file = open(self.path, 'a', encoding='utf-8')
+            self._thread = threading.Thread(target=self._run, args=(journal_file,), name='journal-writer', daemon=True)
+            self._thread.start()
+
+    def append(self, record):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            self.start()
+        self._queue.put(record)
+
+    def close(self):
+        """ Write out everything queued so far and stop the writer. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self, journal_file):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + JOURNAL_FSYNC_INTERVAL
+            while batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    journal_file.write(''.join(json.dumps(record) + '\n' for record in records))
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+            except Exception as e:
+                log_message(f"[ERROR] Could not write to job journal: {e}", 'error')
+            if stopping:
+                journal_file.close()
+                return
+
+JOURNAL = JobJournal(os.path.join(DATA_DIR, 'journal.jsonl'))
+atexit.register(JOURNAL.close)
+
+class ManifestWriter:
+    """ Lists the finished tracks of each output folder in an append-only manifest.jsonl, one
+    {'id', 'title', 'path', 'size', 'duration', 'format', 'downloaded_at', 'order'} record per track,
+    and in a playlist.m3u8 rebuilt from it.
+
+    add() only queues the record. A background thread collects what arrives within
+    MANIFEST_FLUSH_INTERVAL and writes each folder once per batch, so finishing a track never
+    waits for (possibly network) file I/O.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def add(self, folder, record):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='manifest-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((folder, record))
+
+    def close(self):
+        """ Write out everything queued so far and stop the writer. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + MANIFEST_FLUSH_INTERVAL
+            while batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            by_folder = {}
+            for entry in batch:
+                if entry is not None:
+                    by_folder.setdefault(entry[0], []).append(entry[1])
+            for folder, records in by_folder.items():
+                try:
+                    self._write(folder, records)
+                except Exception as e:
+                    log_message(f"[ERROR] Could not update the track list in {folder}: {e}", 'error')
+            if batch[-1] is None:
+                return
+
+    def _write(self, folder, records):
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        # One unbuffered append per batch, so writers in other processes sharing the library
+        # (remote workers, a batch run next to the server) do not split each other's lines
+        with open(manifest_path, 'ab', buffering=0) as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+
+        # Rebuilt from the whole manifest, including what other processes appended
+        playlist = {}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    playlist[os.path.basename(record['path'])] = record
+                except (ValueError, TypeError, KeyError):
+                    continue
+
+        def position(entry):
+            # Playlist order; single videos (no order) after that, by name
+            name, record = entry
+            return record.get('order') is None, record.get('order') or 0, name
+
+        lines = ['#EXTM3U']
+        for name, record in sorted(playlist.items(), key=position):
+            title = ' '.join(str(record['title']).split())
+            lines.append(f"#EXTINF:{int(record['duration'] or -1)},{title}")
+            lines.append(name)
+        # Renamed into place, so players never read a half-written playlist
+        staging = os.path.join(folder, f".{PLAYLIST_FILE}.{uuid.uuid4().hex[:8]}.part")
+        with open(staging, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(staging, os.path.join(folder, PLAYLIST_FILE))
+
+MANIFESTS = ManifestWriter()
+atexit.register(MANIFESTS.close)
+
+def _already_downloaded(entry):
+    """ True if an index entry (looked up for its folder) still points at an intact file. """
+    path = entry['path']
+    try:
+        return os.path.getsize(path) == entry['size']
+    except OSError:
+        # Remote workers report paths on their machines. If this one cannot see that folder at
+        # all, their report is all there is to go by.
+        return WORK_LEASES.enabled and not os.path.isdir(os.path.dirname(path))
+
+# Parts of the info dict the download stage never uses, but that can make up most of its size
+UNCACHED_INFO_KEYS = ('automatic_captions', 'subtitles', 'heatmap')
+
+def cacheable_info(info):
+    """ A JSON-safe copy of a yt-dlp info dict that can later be passed to YoutubeDL.process_ie_result. """
+    info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    for key in UNCACHED_INFO_KEYS:
+        info.pop(key, None)
+    return info
+
+def _song_from_entry(entry, order, default_album):
+    return {
+        'id': entry['id'],
+        'title': entry['title'],
+        'uploader': entry.get('uploader'),
+        'artist': entry.get('artist', entry.get('uploader') or entry.get('channel') or 'Unknown Artist'),
+        'album': entry.get('album', default_album),
+        'thumbnail': entry.get('thumbnail'),
+        'order': order
+    }
+
+class PlaylistListing:
+    """ The songs of one URL, as found by an extraction running on EXTRACTION_EXECUTOR.
+
+    A fast (flat) extraction appends songs while yt-dlp pages through the playlist, so readers
+    can start paging through the result long before the whole playlist has been listed; full
+    per-video metadata is only extracted later, by the download stage, for selected songs.
+    A full extraction adds all songs at once when it is done.
+    """
+    def __init__(self, url, fast):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.fast = fast
+        self.playlist_title = None
+        self.is_playlist = True
+        self.songs = []
+        self.cached = False
+        self.done = False
+        self.error = None
+        self.changed = threading.Condition()
+
+    def page(self, offset, limit, wait):
+        """ Songs [offset, offset + limit) (all from offset if limit is None), waiting up to `wait`
+        seconds for them to be listed. """
+        deadline = time.monotonic() + wait
+        with self.changed:
+            while not self.done and (limit is None or len(self.songs) < offset + limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            return {
+                'listing_id': self.id,
+                'playlist_title': self.playlist_title,
+                'is_playlist': self.is_playlist,
+                'songs': self.songs[offset:None if limit is None else offset + limit],
+                'offset': offset,
+                'available': len(self.songs),
+                'done': self.done,
+                'error': self.error,
+                'cached': self.cached,
+            }
+
+LISTINGS = {}
+listings_lock = threading.Lock()
+EXTRACTION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(EXTRACTION_WORKERS, thread_name_prefix='extract')
+
+def _fill_listing(listing):
+    ydl_opts = {
+        'quiet': True,
+        'noplaylist': False,
+        'extract_flat': 'in_playlist',
+        'logger': YtdlpLogger(),
+        'extractor_args': {"youtube": {"player_client": ["default"]}}
+    }
+    started = time.perf_counter()
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # process=False keeps 'entries' lazy: yt-dlp fetches the next page of the playlist
+            # only when we iterate that far
+            wait_for_request_slot(listing.url)
+            info = ydl.extract_info(listing.url, download=False, process=False)
+            while info and info.get('_type') in ('url', 'url_transparent'):
+                wait_for_request_slot(info['url'])
+                info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+            if not info:
+                raise Exception("yt-dlp could not extract any info. The URL might be invalid, private, or geo-restricted.")
+
+            if 'entries' in info:
+                with listing.changed:
+                    listing.playlist_title = info.get('title', 'Unknown Playlist')
+                for index, entry in enumerate(info['entries']):
+                    if entry and entry.get('id') and entry.get('title'):
+                        song = _song_from_entry(entry, index, listing.playlist_title)
+                        with listing.changed:
+                            listing.songs.append(song)
+                            listing.changed.notify_all()
+            else:
+                with listing.changed:
+                    listing.is_playlist = False
+                    listing.playlist_title = info.get('title', 'Unknown Video')
+                    listing.songs.append(_song_from_entry(info, 0, info.get('album', 'Unknown Album')))
+    except Exception as e:
+        METRICS.inc('ytmp3_failures_total', stage='extract', error_class=classify_error(str(e)))
+        log_message(f"[ERROR] Failed to list {listing.url}: {e}", 'error')
+        listing.error = str(e)
+    METRICS.observe('ytmp3_extraction_seconds', time.perf_counter() - started, kind='listing')
+
+    if listing.error is None:
+        try:
+            METADATA_CACHE.put(f"listing:{listing.url}", {
+                'playlist_title': listing.playlist_title,
+                'is_playlist': listing.is_playlist,
+                'songs': listing.songs,
+            })
+        except Exception as e:
+            log_message(f"[WARNING] Could not update the metadata cache: {e}", 'warning')
+    with listing.changed:
+        listing.done = True
+        listing.changed.notify_all()
+
+def _extract_full(listing):
+    """ Full extraction: every video's complete info, cached for the download stage. """
+    ydl_info_opts = {
+        'quiet': True,
+        'noplaylist': False,
+        'logger': YtdlpLogger(),
+        'extractor_args': {"youtube": {"player_client": ["default"]}}
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_info_opts) as ydl:
+            wait_for_request_slot(listing.url)
+            started = time.perf_counter()
+            info = ydl.extract_info(listing.url, download=False)
+            METRICS.observe('ytmp3_extraction_seconds', time.perf_counter() - started, kind='playlist')
+            if not info:
+                raise Exception("yt-dlp could not extract any info. The URL might be invalid, private, or geo-restricted.")
+
+            songs = []
+            video_infos = []
+            if 'entries' in info:
+                is_playlist = True
+                playlist_title = info.get('title', 'Unknown Playlist')
+                for index, entry in enumerate(info['entries']):
+                    if entry and 'id' in entry and 'title' in entry:
+                        video_infos.append(entry)
+                        songs.append(_song_from_entry(entry, index, playlist_title))
+            else:
+                is_playlist = False
+                playlist_title = info.get('title', 'Unknown Video')
+                video_infos.append(info)
+                songs.append(_song_from_entry(info, 0, 'Unknown Album'))
+
+        result = {"playlist_title": playlist_title, "songs": songs, "is_playlist": is_playlist}
+        try:
+            METADATA_CACHE.put_many(
+                [(f"playlist:{listing.url}", result)] + [(f"video:{entry['id']}", cacheable_info(entry)) for entry in video_infos]
+            )
+        except Exception as e:
+            log_message(f"[WARNING] Could not update the metadata cache: {e}", 'warning')
+        with listing.changed:
+            listing.playlist_title = playlist_title
+            listing.is_playlist = is_playlist
+            listing.songs = songs
+    except Exception as e:
+        METRICS.inc('ytmp3_failures_total', stage='extract', error_class=classify_error(str(e)))
+        log_message(f"[ERROR] Failed to fetch info: {str(e)}", 'error')
+        listing.error = str(e)
+    with listing.changed:
+        listing.done = True
+        listing.changed.notify_all()
+
+def start_listing(url, refresh=False, fast=True):
+    """ Begin listing `url` on the extraction executor, answer it from the metadata cache, or
+    join an extraction of the same URL that is already running. """
+    cached = None
+    if not refresh:
+        cached = METADATA_CACHE.get(f"listing:{url}" if fast else f"playlist:{url}", SETTINGS['metadata_ttl'])
+    listing = PlaylistListing(url, fast)
+    if cached is not None:
+        listing.playlist_title = cached['playlist_title']
+        listing.is_playlist = cached['is_playlist']
+        listing.songs = cached['songs']
+        listing.cached = True
+        listing.done = True
+    with listings_lock:
+        if cached is None:
+            for other in LISTINGS.values():
+                if other.url == url and other.fast == fast and not other.done:
+                    return other
+        finished = [listing_id for listing_id, other in LISTINGS.items() if other.done]
+        for listing_id in finished[:max(0, len(LISTINGS) + 1 - MAX_LISTINGS)]:
+            del LISTINGS[listing_id]
+        LISTINGS[listing.id] = listing
+    if not listing.done:
+        EXTRACTION_EXECUTOR.submit(_fill_listing if fast else _extract_full, listing)
+    return listing
+
+def _job_summary(job):
+    """ A copy of the job without its per-item results, for listings. """
+    return {key: value for key, value in job.items() if key != 'results'}
+
+def _prune_finished_jobs():
+    """ Drop the oldest finished jobs beyond MAX_FINISHED_JOBS. Must be called with status_lock held. """
+    finished = [job_id for job_id, job in JOBS.items() if job['status'] in ('finished', 'error')]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del JOBS[job_id]
+
+class ProgressSlot:
+    """ Latest download progress of one item, fed by its download's progress_hook.
+
+    Parallel stream downloads (e.g. the video and audio of an MP4) call the hook from several
+    threads, so update() must be called with the item's stream_lock held. It tells the hook when
+    the throttling thresholds allow publishing; publish() then copies the latest values into the
+    shared item under status_lock (without stream_lock, so it may miss an update racing with it,
+    which the next publish picks up). Suppressed updates are counted in `dropped`, and publish()
+    returns how many there were since the previous one.
+    """
+    __slots__ = ('progress', 'published', 'published_at', 'dropped', 'dropped_published', 'bytes', 'bytes_published')
+
+    def __init__(self):
+        self.progress = 0.0
+        self.published = 0.0
+        self.published_at = 0.0
+        self.dropped = 0
+        self.dropped_published = 0
+        self.bytes = 0
+        self.bytes_published = 0
+
+    def update(self, progress, downloaded_bytes):
+        if downloaded_bytes < self.bytes:
+            # A new stream started (e.g. the audio after the video of an MP4)
+            self.bytes_published -= self.bytes
+        self.bytes = downloaded_bytes
+        self.progress = progress
+        now = time.monotonic()
+        if now - self.published_at >= PROGRESS_MIN_INTERVAL and abs(progress - self.published) >= PROGRESS_MIN_DELTA:
+            self.published_at = now
+            return True
+        self.dropped += 1
+        return False
+
+    def publish(self, job, item):
+        """ Must be called with status_lock held. Returns how many updates were dropped since the last publish. """
+        dropped_total = self.dropped
+        dropped = dropped_total - self.dropped_published
+        self.published = self.progress
+        item['progress'] = self.progress
+        item['progress_updates_dropped'] = dropped_total
+        job['progress_updates_dropped'] += dropped
+        self.dropped_published = dropped_total
+        POOL_STATS['bytes_downloaded'] += self.bytes - self.bytes_published
+        self.bytes_published = self.bytes
+        _touch(job, item)
+        return dropped
+
+def _count_progress_updates(published, throttled):
+    """ Add to ytmp3_progress_updates_total once per publish, not on every progress_hook call. """
+    if published:
+        METRICS.inc('ytmp3_progress_updates_total', published, result='published')
+    if throttled:
+        METRICS.inc('ytmp3_progress_updates_total', throttled, result='throttled')
+
+def _touch(job, item=None):
+    """ Record that a job (or one of its items) changed: bumps the revision counters used by
+    /status?since= and the ETag, and notifies /events streams. Must be called with status_lock held. """
+    job['revision'] += 1
+    if item is not None:
+        item['revision'] = job['revision']
+    EVENTS.publish_change(job['id'], item['id'] if item else None)
+
+ITEM_TERMINAL_STATES = ('finished', 'error', 'skipped')
+
+def _mark_item_done(job, item, status, error_message=None, journal=True):
+    """ Move an item to a terminal state and update the job counters. Must be called with status_lock held.
+    journal=False is for state restored from the journal, which is already written. """
+    if item['status'] in ITEM_TERMINAL_STATES:
+        return
+    item['status'] = status
+    if status == 'finished':
+        item['progress'] = 100.0
+        job['downloaded_items'] += 1
+        POOL_STATS['items_finished'] += 1
+    elif status == 'skipped':
+        item['progress'] = 100.0
+        job['skipped_items'] += 1
+        POOL_STATS['items_skipped'] += 1
+    else:
+        item['error_message'] = error_message
+        job['failed_items'] += 1
+        POOL_STATS['items_failed'] += 1
+        if error_message and THROTTLE_PATTERN.search(error_message):
+            POOL_STATS['items_throttled'] += 1
+    _touch(job, item)
+    if journal:
+        JOURNAL.append({'event': 'item', 'job_id': job['id'], 'id': item['id'], 'status': status, 'error_message': error_message})
+    if job['downloaded_items'] + job['failed_items'] + job['skipped_items'] >= job['total_items']:
+        job['status'] = 'finished'
+        job['finished_at'] = time.time()
+        _touch(job)
+        JOURNAL.append({'event': 'job_done', 'id': job['id'], 'status': 'finished'})
+
+def unique_songs(songs):
+    """ The songs without repeats of a video id (playlists may list a video twice); first one wins. """
+    seen = set()
+    return [song for song in songs if not (song['id'] in seen or seen.add(song['id']))]
+
+def create_job(songs, playlist_title, format_type, is_playlist, job_id=None, journal=True):
+    """ Register a new job (or a resumed one, keeping its old job_id) and journal it, unless
+    journal=False because it was restored from the journal. """
+    job_id = job_id or uuid.uuid4().hex[:12]
+    songs = unique_songs(songs)
+    job = {
+        'id': job_id,
+        'playlist_title': playlist_title,
+        'format': format_type,
+        'is_playlist': is_playlist,
+        'created_at': time.time(),
+        'finished_at': None,
+        'total_items': 0,
+        'downloaded_items': 0,
+        'failed_items': 0,
+        'skipped_items': 0,
+        'progress_updates_dropped': 0,
+        'status': 'queued',
+        'revision': 0,
+        # Built in playlist order, so readers never have to sort
+        'results': {song['id']: {
+            'id': song['id'],
+            'title': song['title'],
+            'uploader': song.get('uploader'),
+            'artist': song.get('artist'),
+            'album': song.get('album'),
+            'status': 'pending',
+            'progress': 0.0,
+            'progress_updates_dropped': 0,
+            'attempts': 0,
+            'thumbnail': song.get('thumbnail'),
+            'order': song['order'],
+            'revision': 0
+        } for song in sorted(songs, key=lambda x: x.get('order', 0))}
+    }
+    # Counted from results, so the job finishes once every item in it is done
+    job['total_items'] = len(job['results'])
+    with status_lock:
+        _prune_finished_jobs()
+        JOBS[job_id] = job
+    if journal:
+        JOURNAL.append(_journal_job_record(job, songs))
+    return job
+
+def _journal_job_record(job, songs):
+    return {
+        'event': 'job',
+        'id': job['id'],
+        'playlist_title': job['playlist_title'],
+        'format': job['format'],
+        'is_playlist': job['is_playlist'],
+        'songs': songs,
+    }
+
+def _song_from_item(item):
+    """ The song dict (as sent to /download) an item was created from. """
+    return {key: item[key] for key in ('id', 'title', 'uploader', 'artist', 'album', 'thumbnail', 'order')}
+
+# --- Rate limiting shared by all workers ---
+
+class TokenBucket:
+    """ Thread-safe token bucket holding up to one second's worth of tokens.
+
+    reserve() always takes the tokens, going into debt if necessary, and returns how long the
+    caller must sleep to pay that debt off. Callers queue up fairly behind each other that way.
+    """
+    def __init__(self):
+        # Starts full
+        self._tokens = float('inf')
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount, rate):
+        if rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= amount
+            return -self._tokens / rate if self._tokens < 0 else 0.0
+
+class ThrottleBackoff:
+    """ AIMD control of the shared limits: multiplicative decrease when YouTube throttles us,
+    additive recovery while it doesn't, plus a pause of new requests right after throttling. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scale = 1.0
+        self._pause = THROTTLE_PAUSE
+        self._paused_until = 0.0
+        self._last_change = time.monotonic()
+        self.events = 0
+
+    def throttled(self, reason):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                # Same incident, seen by another worker
+                return
+            self.events += 1
+            self._scale = max(THROTTLE_MIN_SCALE, self._scale / 2)
+            self._paused_until = now + self._pause
+            pause, self._pause = self._pause, min(THROTTLE_MAX_PAUSE, self._pause * 2)
+            self._last_change = now
+            scale = self._scale
+        log_message(f"[WARNING] Throttled ({reason}); pausing requests for {pause}s, limits at {scale:.0%}", 'warning')
+
+    def scale(self):
+        with self._lock:
+            now = time.monotonic()
+            steps = int((now - self._last_change) / THROTTLE_RECOVERY_INTERVAL)
+            if steps and self._scale < 1.0:
+                self._scale = min(1.0, self._scale + steps * THROTTLE_RECOVERY_STEP)
+                self._last_change += steps * THROTTLE_RECOVERY_INTERVAL
+            if self._scale >= 1.0:
+                self._pause = THROTTLE_PAUSE
+            return self._scale
+
+    def pause_remaining(self):
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def summary(self):
+        return {'scale': round(self.scale(), 3), 'paused_for': round(self.pause_remaining(), 1), 'events': self.events}
+
+BANDWIDTH_BUCKET = TokenBucket()
+REQUEST_BUCKETS = {}
+request_buckets_lock = threading.Lock()
+BACKOFF = ThrottleBackoff()
+
+def throttle_bandwidth(received_bytes):
+    """ Sleep as long as needed to keep all workers together under max_download_kbps. """
+    limit = SETTINGS['max_download_kbps']
+    if limit and received_bytes > 0:
+        delay = BANDWIDTH_BUCKET.reserve(received_bytes, limit * 1024 * BACKOFF.scale())
+        if delay > 0:
+            time.sleep(delay)
+
+def wait_for_request_slot(url):
+    """ Block until an extraction request to url's host is allowed by the backoff pause and requests_per_minute. """
+    pause = BACKOFF.pause_remaining()
+    if pause > 0:
+        time.sleep(pause)
+    limit = SETTINGS['requests_per_minute']
+    if not limit:
+        return
+    host = urlsplit(url).hostname or ''
+    with request_buckets_lock:
+        bucket = REQUEST_BUCKETS.get(host)
+        if bucket is None:
+            bucket = REQUEST_BUCKETS[host] = TokenBucket()
+    delay = bucket.reserve(1, limit / 60 * BACKOFF.scale())
+    if delay > 0:
+        time.sleep(delay)
+
+class YtdlpLogger:
+    def debug(self, msg):
+        # yt-dlp sends both its info and its verbose output here; the latter is prefixed '[debug] '
+        level = 'debug' if msg.startswith('[debug] ') else 'info'
+        if log_enabled(level) and 'Destination' not in msg:
+            log_message(msg, level)
+    def warning(self, msg):
+        # yt-dlp reports the 429s it is about to retry as warnings
+        if THROTTLE_PATTERN.search(msg):
+            BACKOFF.throttled(msg)
+        if log_enabled('warning'):
+            log_message(f"[WARNING] {msg}", 'warning')
+    def error(self, msg):
+        if THROTTLE_PATTERN.search(msg):
+            BACKOFF.throttled(msg)
+        log_message(f"[ERROR] {msg}", 'error')
+
+class WorkerYoutubeDL:
+    """ A YoutubeDL that lives as long as the worker thread owning it, so extractor state, the
+    cookie jar and HTTP connections carry over from one song to the next.
+
+    yt-dlp hooks are registered once and routed by video id to whichever per-song hook the
+    worker registered with song().
+    """
+    def __init__(self, params):
+        self.hooks = {}
+        self.ydl = yt_dlp.YoutubeDL({**params, 'progress_hooks': [self._dispatch], 'postprocessor_hooks': [self._dispatch]})
+
+    def _dispatch(self, d):
+        hook = self.hooks.get((d.get('info_dict') or {}).get('id'))
+        if hook is not None:
+            hook(d)
+
+    @contextlib.contextmanager
+    def song(self, video_id, hook):
+        self.hooks[video_id] = hook
+        try:
+            yield self.ydl
+        finally:
+            self.hooks.pop(video_id, None)
+
+_worker_state = threading.local()
+
+def _worker_ydl(key, params):
+    """ The calling worker thread's long-lived YoutubeDL for `key`, created from `params` on first use.
+    Options that yt-dlp compiles at construction (format selector, postprocessors) must be part of the key. """
+    instances = getattr(_worker_state, 'ydls', None)
+    if instances is None:
+        instances = _worker_state.ydls = {}
+    if key not in instances:
+        instances[key] = WorkerYoutubeDL(params)
+    return instances[key]
+
+def _close_worker_ydls():
+    for instance in getattr(_worker_state, 'ydls', {}).values():
+        instance.ydl.close()
+    _worker_state.ydls = {}
+
+def _lookup_item(job_id, video_id):
+    with status_lock:
+        job = JOBS.get(job_id)
+        item = job['results'].get(video_id) if job else None
+    return job, item
+
+def _fail_item(job, item, song, error, stage):
+    error_class = classify_error(str(error))
+    METRICS.inc('ytmp3_failures_total', stage=stage, error_class=error_class)
+    if error_class == 'throttled':
+        BACKOFF.throttled(str(error))
+    with status_lock:
+        _mark_item_done(job, item, 'error', str(error))
+    log_message(f"Failed to download {song['title']}: {error}", 'error')
+
+def _retry_delay(attempt, error_class):
+    """ Exponential backoff with jitter; throttled retries also wait out the shared backoff pause. """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    delay = random.uniform(delay / 2, delay)
+    if error_class == 'throttled':
+        delay = max(delay, BACKOFF.pause_remaining())
+    return delay
+
+def _retry_or_fail(job, item, song, context, error):
+    """ Download-stage failure: schedule a retry for transient errors, fail the item for permanent ones. """
+    message = str(error)
+    error_class = classify_error(message)
+    with status_lock:
+        attempt = item['attempts'] + 1
+        retry = attempt <= RETRY_POLICY.get(error_class, 0) and item['status'] not in ITEM_TERMINAL_STATES
+        if retry:
+            delay = _retry_delay(attempt, error_class)
+            item['attempts'] = attempt
+            item['status'] = 'retrying'
+            item['error_message'] = message
+            item['retry_at'] = time.time() + delay
+            if error_class == 'throttled':
+                POOL_STATS['items_throttled'] += 1
+            _touch(job, item)
+    if not retry:
+        _fail_item(job, item, song, error, 'download')
+        return
+    if error_class == 'throttled':
+        BACKOFF.throttled(message)
+    METRICS.inc('ytmp3_retries_total', error_class=error_class)
+    log_message(f"[WARNING] {song['title']}: {error_class} error, retry {attempt} in {delay:.0f}s ({message})", 'warning')
+    RETRY_SCHEDULER.schedule(delay, job['id'], song, context)
+
+class ConnectionBudget:
+    """ Download connections in use, capped at the download pool size, so that a download using
+    several connections takes the slots of otherwise idle workers instead of adding to them. """
+    def __init__(self, pool):
+        self.pool = pool
+        self.in_use = 0
+        self._changed = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, connections):
+        """ Wait until `connections` (capped at the pool size) are free and hold them. Yields the count. """
+        with self._changed:
+            connections = max(1, min(connections, self.pool.size))
+            while self.in_use and self.in_use + connections > self.pool.size:
+                self._changed.wait()
+            self.in_use += connections
+        try:
+            yield connections
+        finally:
+            with self._changed:
+                self.in_use -= connections
+                self._changed.notify_all()
+
+def _download_streams_in_parallel(ydl, info, connections):
+    """ Download the separate streams of a processed info dict (e.g. MP4 video + M4A audio) at the
+    same time, splitting `connections` between them as concurrent fragments, then merge them.
+
+    This is what YoutubeDL.process_info does for 'video+audio' formats, except that it downloads
+    the streams one after the other. Returns the info dict with 'filepath' set to the merged file.
+    """
+    streams = info.get('requested_formats') or []
+    if len(streams) < 2:
+        return ydl.process_ie_result(info, download=True)
+
+    filename = ydl.prepare_filename(info)
+    if os.path.exists(filename):
+        return dict(info, filepath=filename)
+    ydl.params['concurrent_fragment_downloads'] = max(1, connections // len(streams))
+    info = dict(info, requested_formats=[dict(stream) for stream in streams])
+    stream_downloads = []
+    for stream in info['requested_formats']:
+        stream_info = {key: value for key, value in info.items() if key != 'requested_formats'}
+        stream_info.update(stream)
+        # Same names yt-dlp uses for the parts of a merged download, e.g. 'Song.f137.mp4', 'Song.f140.m4a'
+        stream['filepath'] = f"{os.path.splitext(filename)[0]}.f{stream['format_id']}.{stream_info['ext']}"
+        stream_downloads.append((stream['filepath'], stream_info))
+
+    with concurrent.futures.ThreadPoolExecutor(len(stream_downloads), thread_name_prefix='stream') as executor:
+        futures = [executor.submit(ydl.dl, path, stream_info) for path, stream_info in stream_downloads]
+        results = [future.result() for future in futures]
+    if not all(success for success, _ in results):
+        raise Exception("Downloading one of the streams failed.")
+
+    files = [path for path, _ in stream_downloads]
+    merged_files, info = FFmpegMergerPP(ydl).run(dict(info, filepath=filename, __files_to_merge=files))
+    for path in merged_files:
+        os.remove(path)
+    return info
+
+def _cached_thumbnail(ydl, info, song):
+    """ The track's artwork as a thumbnails entry pointing into THUMBNAIL_CACHE, or None. """
+    url = info.get('thumbnail') or song.get('thumbnail')
+    if not url:
+        return None
+    try:
+        return {'id': 'cached', 'url': url, 'filepath': THUMBNAIL_CACHE.get(ydl, url)}
+    except Exception as e:
+        log_message(f"[WARNING] Could not fetch the artwork for {song['title']}: {e}", 'warning')
+        return None
+
+def _release_thumbnails(info):
+    """ Hand the artwork _cached_thumbnail() took for a track back to THUMBNAIL_CACHE. """
+    for thumbnail in info.get('thumbnails') or ():
+        if thumbnail.get('id') == 'cached':
+            THUMBNAIL_CACHE.release(thumbnail['filepath'])
+
+def _download_single_song(job_id, song, context):
+    """ Download stage: fetch the media (and thumbnail) only, then queue the file for transcoding. """
+    video_id = song['id']
+    job, item = _lookup_item(job_id, video_id)
+    if item is None:
+        return
+    with status_lock:
+        # Re-running a finished item would count it twice
+        if item['status'] in ITEM_TERMINAL_STATES:
+            return
+    progress_slot = ProgressSlot()
+    # (downloaded, total) bytes per stream, summed up for the item's progress. Parallel stream
+    # downloads call the hook from several threads, hence the lock.
+    stream_bytes = {}
+    stream_lock = threading.Lock()
+
+    def progress_hook(d):
+        if d['status'] == 'downloading':
+            stream = (d.get('info_dict') or {}).get('format_id')
+            downloaded_bytes = d.get('downloaded_bytes', 0)
+            with stream_lock:
+                previous = stream_bytes.get(stream, (0, 0))[0]
+                stream_bytes[stream] = (downloaded_bytes, d.get('total_bytes') or d.get('total_bytes_estimate', 0))
+                received = downloaded_bytes - previous if downloaded_bytes >= previous else downloaded_bytes
+                all_downloaded = sum(done for done, _ in stream_bytes.values())
+                all_total = sum(total for _, total in stream_bytes.values())
+            if all_total > 0:
+                progress = (all_downloaded / all_total) * 100
+                with stream_lock:
+                    publish = progress_slot.update(progress, all_downloaded)
+                if publish:
+                    with status_lock:
+                        throttled = progress_slot.publish(job, item)
+                    _count_progress_updates(1, throttled)
+            # Sleeping here, outside status_lock, holds up this stream's download loop
+            throttle_bandwidth(received)
+
+    # yt-dlp's .part files and the merge/convert temporaries all stay in the scratch folder
+    if context['is_playlist']:
+        output_template = os.path.join(
+            context['scratch_folder'],
+            f"{song['order'] + 1:02d} - %(artist, 'Unknown Artist')s - %(title)s.%(ext)s"
+        )
+    else:
+        output_template = os.path.join(
+            context['scratch_folder'],
+            f"%(artist, 'Unknown Artist')s - %(title)s.%(ext)s"
+        )
+
+    format_selector = context['format_options']['format']
+    thumbnail = None
+    ydl_opts = {
+        # Artwork comes from THUMBNAIL_CACHE instead of a per-track download
+        'writethumbnail': False,
+        'ffmpeg_location': FFMPEG_PATH, # ### MODIFICATION ###: This is now a directory
+        'yesplaylist': False,
+        'ignoreerrors': False,
+        'logger': YtdlpLogger(),
+        # Only a quick inline retry; RETRY_SCHEDULER handles anything longer without holding the worker
+        'retries': 1,
+        'fragment_retries': 3,
+        'extractor_retries': 1,
+        # Pick up .part files left behind by an interrupted run instead of starting over
+        'continuedl': True,
+        'quiet': True,
+        'extractor_args': {"youtube": {"player_client": ["default"]}},
+        # Conversion and tagging happen in the transcode stage
+        'format': format_selector,
+    }
+
+    try:
+        with status_lock:
+            item['status'] = 'downloading'
+            _touch(job, item)
+            if job['status'] == 'queued':
+                job['status'] = 'downloading'
+                _touch(job)
+        started = time.perf_counter()
+        worker_ydl = _worker_ydl(('download', format_selector), ydl_opts)
+        # Only formats made of separate streams can use more than one connection
+        wanted_connections = SETTINGS['connections_per_file'] if '+' in format_selector else 1
+        with CONNECTION_BUDGET.reserve(wanted_connections) as connections, \
+                worker_ydl.song(video_id, progress_hook) as ydl:
+            # The output template is read per download, so it can change between songs
+            ydl.params['outtmpl']['default'] = output_template
+            ydl.params['concurrent_fragment_downloads'] = 1
+            parallel = connections > 1
+            info = None
+            cached_info = METADATA_CACHE.get(f"video:{video_id}", SETTINGS['metadata_ttl'])
+            if cached_info is not None:
+                try:
+                    info = ydl.process_ie_result(cached_info, download=not parallel)
+                except Exception as e:
+                    log_message(f"[WARNING] Cached info for {song['title']} did not work ({e}), extracting again", 'warning')
+            if info is None:
+                video_url = f"https://www.youtube.com/watch?v={video_id}"
+                wait_for_request_slot(video_url)
+                info = ydl.extract_info(video_url, download=not parallel)
+            if parallel:
+                info = _download_streams_in_parallel(ydl, info, connections)
+            thumbnail = _cached_thumbnail(ydl, info, song)
+        downloaded = (info.get('requested_downloads') or [{}])[0]
+        filepath = downloaded.get('filepath') or info.get('filepath')
+        if not filepath:
+            raise Exception("yt-dlp did not report a downloaded file.")
+        # yt-dlp's private '__' keys (pending postprocessors, files to merge) belong to the finished download step
+        info = {key: value for key, value in {**info, **downloaded}.items() if not key.startswith('__')}
+        # EmbedThumbnail picks the last thumbnail that has a 'filepath'
+        info['thumbnails'] = [thumbnail] if thumbnail else []
+    except Exception as e:
+        if thumbnail:
+            THUMBNAIL_CACHE.release(thumbnail['filepath'])
+        with status_lock:
+            throttled = progress_slot.publish(job, item)
+        _count_progress_updates(0, throttled)
+        _retry_or_fail(job, item, song, context, e)
+        return
+    METRICS.observe('ytmp3_download_seconds', time.perf_counter() - started)
+    try:
+        METRICS.observe('ytmp3_track_bytes', os.path.getsize(filepath), format=context['format_options']['profile'])
+    except OSError:
+        pass
+
+    with status_lock:
+        throttled = progress_slot.publish(job, item)
+        item['status'] = 'downloaded'
+        _touch(job, item)
+    _count_progress_updates(0, throttled)
+    # Blocks while the transcode backlog is full, so downloads can't run arbitrarily far ahead
+    TRANSCODE_POOL.submit(job_id, song, context, info, filepath)
+
+# Item status while each yt-dlp postprocessor runs; everything not listed is a conversion
+POSTPROCESSOR_PHASES = {'EmbedThumbnail': 'tagging', 'MoveFiles': None}
+
+def move_into_library(path, folder):
+    """ Move a finished file from scratch into `folder`, so that readers of the library see either
+    no file or the complete one. Returns the new path.
+
+    A rename is atomic on one file system. Across file systems (e.g. tmpfs scratch, network share
+    library) the file is copied next to its destination under a hidden temporary name first.
+    """
+    destination = os.path.join(folder, os.path.basename(path))
+    try:
+        os.replace(path, destination)
+        return destination
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    staging = os.path.join(folder, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        with open(path, 'rb') as source, open(staging, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(staging, destination)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(staging)
+        raise
+    os.remove(path)
+    return destination
+
+def _transcode_single_song(job_id, song, context, info, filepath):
+    """ Transcode stage: run the ffmpeg postprocessors (convert, embed thumbnail) on a downloaded file. """
+    job, item = _lookup_item(job_id, song['id'])
+    if item is None:
+        _release_thumbnails(info)
+        return
+
+    pp_started = {}
+
+    def postprocessor_hook(d):
+        if d['status'] == 'started':
+            pp_started[d['postprocessor']] = time.perf_counter()
+            phase = POSTPROCESSOR_PHASES.get(d['postprocessor'], 'converting')
+            if phase:
+                with status_lock:
+                    item['status'] = phase
+                    _touch(job, item)
+        elif d['status'] == 'finished' and d['postprocessor'] in pp_started:
+            METRICS.observe('ytmp3_postprocess_seconds', time.perf_counter() - pp_started.pop(d['postprocessor']),
+                            postprocessor=d['postprocessor'])
+
+    postprocessors = context['format_options']['postprocessors']
+    ydl_opts = {
+        'ffmpeg_location': FFMPEG_PATH,
+        'postprocessors': postprocessors,
+        'logger': YtdlpLogger(),
+        'quiet': True,
+    }
+    downloaded_info = info
+    try:
+        worker_ydl = _worker_ydl(('transcode', json.dumps(postprocessors, sort_keys=True)), ydl_opts)
+        with worker_ydl.song(song['id'], postprocessor_hook) as ydl:
+            info = ydl.post_process(filepath, info) or info
+    except Exception as e:
+        _fail_item(job, item, song, e, 'transcode')
+        return
+    finally:
+        _release_thumbnails(downloaded_info)
+
+    # Hash the file while it is still on scratch, rather than reading it back from the library.
+    scratch_path = info.get('filepath') or filepath
+    try:
+        size, sha256 = os.path.getsize(scratch_path), file_checksum(scratch_path)
+    except OSError as e:
+        log_message(f"[WARNING] Could not checksum {scratch_path}: {e}", 'warning')
+        size = sha256 = None
+
+    try:
+        output_path = move_into_library(scratch_path, context['playlist_folder'])
+    except Exception as e:
+        _fail_item(job, item, song, e, 'move')
+        return
+
+    if sha256:
+        try:
+            DOWNLOAD_INDEX.record(song['id'], context['format_options']['profile'], output_path,
+                                  size=size, sha256=sha256)
+        except Exception as e:
+            log_message(f"[WARNING] Could not index {output_path}: {e}", 'warning')
+
+    MANIFESTS.add(context['playlist_folder'], {
+        'id': song['id'], 'title': song['title'], 'path': output_path, 'size': size,
+        'duration': info.get('duration'),
+        'format': context['format_options']['profile'], 'downloaded_at': time.time(),
+        'order': song['order'] if context['is_playlist'] else None,
+    })
+
+    with status_lock:
+        item['path'] = output_path
+        _mark_item_done(job, item, 'finished')
+        job_done = job['status'] == 'finished'
+    if job_done:
+        # Only fails if tracks that did not make it left partial files behind
+        with contextlib.suppress(OSError):
+            os.rmdir(context['scratch_folder'])
+
+class WorkerPool:
+    """ A resizable set of long-lived threads consuming one work queue.
+
+    Threads are started on the first submit(). When the pool is shrunk, surplus threads
+    retire after finishing their current task.
+    """
+    def __init__(self, name, work_queue, handler, size):
+        self.name = name
+        self.queue = work_queue
+        self.handler = handler
+        self.size = max(1, size)
+        self.busy = 0
+        self._threads = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def submit(self, *work):
+        if not self._started:
+            self._started = True
+            self._ensure_threads()
+        self.queue.put((time.monotonic(), work))
+
+    def resize(self, size):
+        with self._lock:
+            self.size = max(1, size)
+        if self._started:
+            self._ensure_threads()
+
+    def _ensure_threads(self):
+        with self._lock:
+            self._threads[:] = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{next(self._ids)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        me = threading.current_thread()
+        while True:
+            with self._lock:
+                if len(self._threads) > self.size:
+                    self._threads.remove(me)
+                    break
+            try:
+                queued_at, work = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            METRICS.observe('ytmp3_queue_wait_seconds', time.monotonic() - queued_at, queue=self.name)
+            with self._lock:
+                self.busy += 1
+            _log_context.job_id = work[0]
+            try:
+                self.handler(*work)
+            except Exception as e:
+                log_message(f"[ERROR] {self.name} worker crashed on {work[1].get('title')}: {e}", 'error')
+            finally:
+                _log_context.job_id = None
+                with self._lock:
+                    self.busy -= 1
+                self.queue.task_done()
+        _close_worker_ydls()
+
+DOWNLOAD_POOL = WorkerPool('download', DOWNLOAD_QUEUE, _download_single_song, SETTINGS['workers'])
+TRANSCODE_POOL = WorkerPool('transcode', TRANSCODE_QUEUE, _transcode_single_song, SETTINGS['ffmpeg_workers'])
+
+class RetryScheduler:
+    """ Holds failed downloads until their backoff delay has passed, then hands them back to the
+    download pool. One thread sleeps until the earliest entry of a heap is due. """
+    def __init__(self, pool):
+        self.pool = pool
+        self._heap = []
+        self._ids = itertools.count()
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, *work):
+        with self._changed:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._ids), work))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+                self._thread.start()
+            self._changed.notify()
+
+    @property
+    def pending(self):
+        return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._changed.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, work = heapq.heappop(self._heap)
+            self.pool.submit(*work)
+
+RETRY_SCHEDULER = RetryScheduler(DOWNLOAD_POOL)
+CONNECTION_BUDGET = ConnectionBudget(DOWNLOAD_POOL)
+
+# Item states a remote worker may report for a lease it still holds
+LEASE_REPORTABLE_STATES = ('downloading', 'retrying', 'downloaded', 'converting', 'tagging')
+
+class WorkLeases:
+    """ Download work handed out to remote worker processes instead of the local download pool.
+
+    The coordinator keeps owning jobs and items: workers lease items, report progress with
+    heartbeats that also renew their leases, and report the result with complete(). Expired
+    leases are noticed whenever a worker calls in, so work of a dead worker is reassigned to
+    the next one that asks.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._pending = deque()   # (job_id, song, context, expiries)
+        self._leases = {}         # lease id -> lease dict
+        self._ids = itertools.count(1)
+        self.workers = {}         # worker id -> last time it called in
+        self.stats = {'granted': 0, 'expired': 0, 'completed': 0, 'lost': 0}
+
+    def submit(self, job_id, song, context, expiries=0):
+        with self._lock:
+            self._pending.append((job_id, song, context, expiries))
+
+    def lease(self, worker_id, count):
+        """ Up to `count` new leases for a worker, as JSON-safe dicts. """
+        self._expire()
+        granted = []
+        with self._lock:
+            self.workers[worker_id] = time.monotonic()
+            while self._pending and len(granted) < count:
+                job_id, song, context, expiries = self._pending.popleft()
+                lease = {
+                    'id': f"{job_id}-{next(self._ids)}", 'worker': worker_id, 'job_id': job_id, 'song': song,
+                    'context': context, 'expiries': expiries, 'expires_at': time.monotonic() + LEASE_SECONDS,
+                }
+                self._leases[lease['id']] = lease
+                granted.append(lease)
+            self.stats['granted'] += len(granted)
+        leases = []
+        for lease in granted:
+            job, item = _lookup_item(lease['job_id'], lease['song']['id'])
+            if item is None or item['status'] in ITEM_TERMINAL_STATES:
+                with self._lock:
+                    self._leases.pop(lease['id'], None)
+                continue
+            with status_lock:
+                item['worker'] = worker_id
+                _touch(job, item)
+            context = lease['context']
+            leases.append({
+                'id': lease['id'], 'job_id': lease['job_id'], 'song': lease['song'],
+                'playlist_title': context['playlist_title'], 'format': context['format_type'],
+                'is_playlist': context['is_playlist'], 'lease_seconds': LEASE_SECONDS,
+            })
+        if leases:
+            log_message(f"Leased {len(leases)} track(s) to worker {worker_id}")
+        return leases
+
+    def heartbeat(self, worker_id, reports):
+        """ Renew a worker's leases and apply the progress it reports (validated, as floats).
+        Returns the ids of the reported leases the worker no longer holds, whose work it should drop. """
+        self._expire()
+        lost = []
+        renewed = []
+        with self._lock:
+            self.workers[worker_id] = time.monotonic()
+            for report in reports:
+                lease = self._leases.get(report.get('id'))
+                if lease is None or lease['worker'] != worker_id:
+                    lost.append(report.get('id'))
+                    continue
+                lease['expires_at'] = time.monotonic() + LEASE_SECONDS
+                renewed.append((lease, report))
+        for lease, report in renewed:
+            job, item = _lookup_item(lease['job_id'], lease['song']['id'])
+            if item is None or report.get('status') not in LEASE_REPORTABLE_STATES:
+                continue
+            with status_lock:
+                if item['status'] in ITEM_TERMINAL_STATES:
+                    continue
+                item['status'] = report['status']
+                item['progress'] = report['progress']
+                if job['status'] == 'queued':
+                    job['status'] = 'downloading'
+                    _touch(job)
+                _touch(job, item)
+        return lost
+
+    def complete(self, worker_id, lease_id, status, error_message=None, path=None, size=None, sha256=None):
+        """ Record the result of a lease. False if the worker no longer held it (the item was
+        reassigned after its lease expired), in which case the result is ignored. Finished tracks
+        go into the download index, so the next sync of the playlist does not lease them again. """
+        with self._lock:
+            self.workers[worker_id] = time.monotonic()
+            lease = self._leases.get(lease_id)
+            if lease is None or lease['worker'] != worker_id:
+                self.stats['lost'] += 1
+                return False
+            del self._leases[lease_id]
+            self.stats['completed'] += 1
+        job, item = _lookup_item(lease['job_id'], lease['song']['id'])
+        if item is None:
+            return True
+        if status == 'error':
+            METRICS.inc('ytmp3_failures_total', stage='remote', error_class=classify_error(error_message))
+        if status in ('finished', 'skipped') and path and size is not None and sha256:
+            context = lease['context']
+            try:
+                DOWNLOAD_INDEX.record(lease['song']['id'], context['format_options']['profile'], path,
+                                      size=size, sha256=sha256, folder=context['playlist_folder'])
+            except Exception as e:
+                log_message(f"[WARNING] Could not index {path}: {e}", 'warning')
+        with status_lock:
+            if path:
+                item['path'] = path
+            _mark_item_done(job, item, status if status in ITEM_TERMINAL_STATES else 'error', error_message)
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [lease for lease in self._leases.values() if lease['expires_at'] <= now]
+            for lease in expired:
+                del self._leases[lease['id']]
+            self.stats['expired'] += len(expired)
+        for lease in expired:
+            job, item = _lookup_item(lease['job_id'], lease['song']['id'])
+            if item is None:
+                continue
+            expiries = lease['expiries'] + 1
+            log_message(f"[WARNING] Worker {lease['worker']} stopped reporting on {lease['song']['title']} "
+                        f"(lease expired {expiries}x)", 'warning', job_id=lease['job_id'])
+            with status_lock:
+                if item['status'] in ITEM_TERMINAL_STATES:
+                    continue
+                if expiries >= LEASE_MAX_EXPIRIES:
+                    _mark_item_done(job, item, 'error', f"Lease expired {expiries} times; the track may crash workers.")
+                    continue
+                item['status'] = 'pending'
+                item['progress'] = 0.0
+                item.pop('worker', None)
+                _touch(job, item)
+            with self._lock:
+                # Back to the front: it has waited long enough already
+                self._pending.appendleft((lease['job_id'], lease['song'], lease['context'], expiries))
+
+    def summary(self):
+        self._expire()
+        now = time.monotonic()
+        with self._lock:
+            return dict(
+                self.stats, pending=len(self._pending), leased=len(self._leases),
+                workers=sum(1 for seen in self.workers.values() if now - seen < WORKER_SEEN_SECONDS),
+            )
+
+WORK_LEASES = WorkLeases()
+
+def _autoscale_loop():
+    """ Adaptive pool controller: additive increase while throughput keeps improving and
+    songs are waiting, halve the pool on throttling or a high error rate. """
+    with status_lock:
+        last_stats = dict(POOL_STATS)
+    last_throughput = None
+    last_step = 0
+    while True:
+        time.sleep(ADAPTIVE_INTERVAL)
+        if not SETTINGS['adaptive']:
+            return
+        with status_lock:
+            stats = dict(POOL_STATS)
+        delta = {key: stats[key] - last_stats[key] for key in stats}
+        last_stats = stats
+        throughput = delta['bytes_downloaded'] / ADAPTIVE_INTERVAL
+        attempts = delta['items_finished'] + delta['items_failed']
+        size = DOWNLOAD_POOL.size
+
+        if delta['items_throttled'] or (attempts and delta['items_failed'] / attempts > ADAPTIVE_MAX_ERROR_RATE):
+            new_size, reason = size // 2, 'throttling/errors'
+        elif DOWNLOAD_QUEUE.empty():
+            new_size, reason = size, 'idle'
+        elif last_step > 0 and last_throughput is not None and throughput < last_throughput * 1.05:
+            new_size, reason = size - 1, 'no gain from last increase'
+        else:
+            new_size, reason = size + 1, 'backlog'
+        new_size = max(SETTINGS['min_workers'], min(SETTINGS['max_workers'], new_size))
+
+        last_step = new_size - size
+        last_throughput = throughput
+        if new_size != size:
+            DOWNLOAD_POOL.resize(new_size)
+            log_message(f"[INFO] Adaptive pool: {size} -> {new_size} workers ({reason}, {throughput / 1024:.0f} KiB/s)")
+
+def _parse_setting(name, value):
+    kind = SETTING_TYPES.get(name)
+    if kind is None:
+        raise ValueError(f"Unknown setting '{name}'.")
+    if kind is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+    if name == 'log_level':
+        value = str(value).strip().lower()
+        if value not in LOG_LEVELS:
+            raise ValueError(f"Setting 'log_level' must be one of {', '.join(LOG_LEVELS)}.")
+        return value
+    if name in ('output_dir', 'scratch_dir'):
+        value = str(value).strip()
+        if not value:
+            if name == 'output_dir':
+                raise ValueError("Setting 'output_dir' must not be empty.")
+            return value
+        return os.path.abspath(os.path.expanduser(value))
+    value = kind(value)
+    minimum = 0 if name in UNLIMITED_SETTINGS else 1
+    if value < minimum:
+        raise ValueError(f"Setting '{name}' must be at least {minimum}.")
+    return value
+
+def apply_settings(changes):
+    """ Validate and apply a dict of setting changes, resizing the pools as needed. Raises ValueError. """
+    global _autoscaler_thread
+    parsed = {name: _parse_setting(name, value) for name, value in changes.items()}
+    SETTINGS.update(parsed)
+    if SETTINGS['min_workers'] > SETTINGS['max_workers']:
+        SETTINGS['min_workers'] = SETTINGS['max_workers']
+
+    TRANSCODE_POOL.resize(SETTINGS['ffmpeg_workers'])
+    if SETTINGS['adaptive']:
+        size = DOWNLOAD_POOL.size if 'workers' not in parsed else SETTINGS['workers']
+        DOWNLOAD_POOL.resize(max(SETTINGS['min_workers'], min(SETTINGS['max_workers'], size)))
+        if _autoscaler_thread is None or not _autoscaler_thread.is_alive():
+            _autoscaler_thread = threading.Thread(target=_autoscale_loop, name="pool-autoscaler", daemon=True)
+            _autoscaler_thread.start()
+    else:
+        DOWNLOAD_POOL.resize(SETTINGS['workers'])
+
+def _settings_from_env():
+    return {name: os.environ[f"YTMP3_{name.upper()}"] for name in SETTINGS if f"YTMP3_{name.upper()}" in os.environ}
+
+def scratch_root():
+    return SETTINGS['scratch_dir'] or os.path.join(DATA_DIR, 'scratch')
+
+def download_songs_task(job_id, songs, playlist_title, format_type, is_playlist, output_dir=None):
+    """ Prepare the output folder for a job and queue its songs on the shared worker pool.
+    Playlists get a sub-folder of `output_dir` (by default the output_dir setting). Tracks are
+    downloaded and converted in a scratch folder of the job and only moved there once finished. """
+    songs = unique_songs(songs)
+    try:
+        base_folder = output_dir or SETTINGS['output_dir']
+        if is_playlist:
+            playlist_folder = os.path.join(base_folder, sanitize_filename(playlist_title))
+        else:
+            playlist_folder = base_folder
+        os.makedirs(playlist_folder, exist_ok=True)
+        # Named after the job, so a resumed job finds its partial downloads again
+        scratch_folder = os.path.join(scratch_root(), job_id)
+        os.makedirs(scratch_folder, exist_ok=True)
+    except Exception as e:
+        with status_lock:
+            job = JOBS[job_id]
+            job['status'] = 'error'
+            job['error_message'] = f"Failed to create playlist folder: {e}"
+            job['finished_at'] = time.time()
+            _touch(job)
+        JOURNAL.append({'event': 'job_done', 'id': job_id, 'status': 'error'})
+        return
+
+    context = {
+        'playlist_folder': playlist_folder,
+        'scratch_folder': scratch_folder,
+        'playlist_title': playlist_title,
+        'format_type': format_type,
+        'format_options': get_format_options(format_type),
+        'is_playlist': is_playlist,
+    }
+
+    # Tracks already in this folder in the same format are skipped without touching the network
+    try:
+        indexed = DOWNLOAD_INDEX.lookup_many((song['id'] for song in songs), context['format_options']['profile'], playlist_folder)
+    except Exception as e:
+        log_message(f"[WARNING] Download index unavailable, downloading everything: {e}", 'warning')
+        indexed = {}
+    skipped = {song['id'] for song in songs if song['id'] in indexed and _already_downloaded(indexed[song['id']])}
+    if skipped:
+        with status_lock:
+            job = JOBS[job_id]
+            for video_id in skipped:
+                item = job['results'][video_id]
+                item['path'] = indexed[video_id]['path']
+                _mark_item_done(job, item, 'skipped')
+        log_message(f"Skipping {len(skipped)} already downloaded track(s)", job_id=job_id)
+
+    submit = WORK_LEASES.submit if WORK_LEASES.enabled else DOWNLOAD_POOL.submit
+    for song in songs:
+        if song['id'] not in skipped:
+            submit(job_id, song, context)
+
+def resume_journaled_jobs():
+    """ Replay the journal: re-create every job that had not finished and queue its remaining songs.
+
+    Items that already reached a terminal state keep it. The journal is first rewritten with
+    just the records of the resumed jobs, so finished work does not pile up across restarts and
+    a crash while resuming still finds them.
+    """
+    jobs = {}
+    for record in JOURNAL.read():
+        event = record.get('event')
+        if event == 'job':
+            jobs[record['id']] = dict(record, items={})
+        elif event == 'item' and record.get('job_id') in jobs:
+            jobs[record['job_id']]['items'][record['id']] = record
+        elif event == 'job_done':
+            jobs.pop(record['id'], None)
+
+    replayed = []
+    for record in jobs.values():
+        replayed.append({key: value for key, value in record.items() if key != 'items'})
+        replayed.extend(record['items'].values())
+    JOURNAL.start(records=replayed)
+
+    for record in jobs.values():
+        job = create_job(record['songs'], record['playlist_title'], record['format'], record['is_playlist'],
+                         job_id=record['id'], journal=False)
+        with status_lock:
+            for video_id, item_record in record['items'].items():
+                item = job['results'].get(video_id)
+                if item is not None:
+                    _mark_item_done(job, item, item_record['status'], item_record.get('error_message'), journal=False)
+        remaining = [song for song in record['songs'] if song['id'] not in record['items']]
+        if remaining:
+            download_songs_task(job['id'], remaining, record['playlist_title'], record['format'], record['is_playlist'])
+        log_message(f"Resumed job {job['id']} ({record['playlist_title']}): {len(remaining)} song(s) left", job_id=job['id'])
+    return len(jobs)
@@ -0,0 +1,170 @@
+"""
+Remote download worker: leases tracks from a coordinator (`python ytmp3.py --remote-workers`),
+downloads and converts them with the local engine, and reports progress and results back.
+
+    python ytmp3.py worker http://coordinator:5000 [--workers 4] [--out DIR] [--token SECRET]
+
+Run as many workers as needed, on the coordinator's machine or others. Files are written below
+--out on the worker's machine, so point every worker at the shared library. A worker that stops
+sending heartbeats loses its leases, and the coordinator hands those tracks to another worker.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from ytmp3_engine import (
+    DOWNLOAD_INDEX, JOURNAL, LOG_LEVELS, LOG_STORE, SETTINGS, apply_settings, create_job, download_songs_task,
+    get_format_options, log_message, status_lock, _settings_from_env,
+)
+
+# How often leases are renewed; must stay well below the coordinator's LEASE_SECONDS
+HEARTBEAT_INTERVAL = 5
+# How long to wait before asking again when the coordinator had no work or could not be reached
+IDLE_POLL_SECONDS = 3
+REQUEST_TIMEOUT = 30
+
+
+class CoordinatorError(Exception):
+    pass
+
+
+class RemoteWorker:
+    """ Leases up to `slots` tracks at a time and runs each as a one-track job on the local pools. """
+    def __init__(self, coordinator, worker_id, slots, output_dir=None, token=None):
+        self.coordinator = coordinator.rstrip('/')
+        self.worker_id = worker_id
+        self.slots = slots
+        self.output_dir = output_dir
+        self.token = token
+        self.active = {}   # lease id -> local job
+        self.log_cursor = 0
+
+    def _call(self, path, payload):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['X-Worker-Token'] = self.token
+        body = json.dumps(dict(payload, worker=self.worker_id)).encode('utf-8')
+        request = urllib.request.Request(self.coordinator + path, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                # complete() of a lease that expired meanwhile
+                return json.loads(e.read())
+            raise CoordinatorError(f"{path} failed: HTTP {e.code} {e.read()[:200].decode('utf-8', 'replace')}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise CoordinatorError(f"{path} failed: {e}")
+
+    def _start(self, lease):
+        song = lease['song']
+        job = create_job([song], lease['playlist_title'], lease['format'], lease['is_playlist'])
+        self.active[lease['id']] = job
+        try:
+            download_songs_task(job['id'], [song], lease['playlist_title'], lease['format'], lease['is_playlist'], self.output_dir)
+        except ValueError as e:
+            with status_lock:
+                job['status'] = 'error'
+                job['error_message'] = str(e)
+
+    def _report_finished(self):
+        finished = []
+        with status_lock:
+            for lease_id, job in self.active.items():
+                if job['status'] in ('finished', 'error'):
+                    item = next(iter(job['results'].values()))
+                    status = item['status'] if item['status'] in ('finished', 'skipped', 'error') else 'error'
+                    finished.append((lease_id, {'id': lease_id, 'status': status, 'path': item.get('path'),
+                                                'error': item.get('error_message') or job.get('error_message')}))
+        for lease_id, result in finished:
+            if result['status'] in ('finished', 'skipped') and result['path']:
+                result.update(self._file_details(self.active[lease_id], result['path']))
+            if not self._call('/worker/complete', result)['accepted']:
+                log_message(f"[WARNING] Lease {lease_id} had expired; the coordinator gave the track to another worker", 'warning')
+            del self.active[lease_id]
+
+    def _file_details(self, job, path):
+        """ Size and SHA-256 of a finished track from the local download index, for the coordinator's. """
+        video_id = next(iter(job['results']))
+        profile = get_format_options(job['format'])['profile']
+        entry = DOWNLOAD_INDEX.lookup_many([video_id], profile, os.path.dirname(path)).get(video_id)
+        return {'size': entry['size'], 'sha256': entry['sha256']} if entry else {}
+
+    def _heartbeat(self):
+        with status_lock:
+            reports = [{'id': lease_id, 'status': item['status'], 'progress': item['progress']}
+                       for lease_id, job in self.active.items() for item in job['results'].values()]
+        if not reports:
+            return
+        for lease_id in self._call('/worker/heartbeat', {'leases': reports})['lost']:
+            # The download carries on locally, but its result no longer counts
+            log_message(f"[WARNING] Lost lease {lease_id}", 'warning')
+            self.active.pop(lease_id, None)
+
+    def _lease_more(self):
+        free = self.slots - len(self.active)
+        if free <= 0:
+            return 0
+        leases = self._call('/worker/lease', {'max': free})['leases']
+        for lease in leases:
+            self._start(lease)
+        return len(leases)
+
+    def _print_logs(self):
+        lines, self.log_cursor, _ = LOG_STORE.read(after=self.log_cursor)
+        for line in lines:
+            print(f"{time.strftime('%H:%M:%S', time.localtime(line['time']))} {line['message']}", flush=True)
+
+    def run(self):
+        next_heartbeat = 0.0
+        while True:
+            leased = 0
+            try:
+                self._report_finished()
+                if time.monotonic() >= next_heartbeat:
+                    self._heartbeat()
+                    next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+                leased = self._lease_more()
+            except CoordinatorError as e:
+                log_message(f"[ERROR] {e}", 'error')
+            self._print_logs()
+            time.sleep(1 if leased or self.active else IDLE_POLL_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ytmp3 worker', description="Download tracks leased from a ytmp3 coordinator")
+    parser.add_argument('coordinator', help="URL of the coordinator, e.g. http://192.168.1.10:5000")
+    parser.add_argument('--workers', type=int, help="tracks to work on at once (default: 4, or YTMP3_WORKERS)")
+    parser.add_argument('--ffmpeg-workers', type=int, help="concurrent ffmpeg conversions (default: CPU count, or YTMP3_FFMPEG_WORKERS)")
+    parser.add_argument('--out', help="library folder; playlists get a sub-folder (default: ~/Music/YTMusicDownloader, or YTMP3_OUTPUT_DIR)")
+    parser.add_argument('--scratch-dir', help="folder for partial downloads and conversions, e.g. on tmpfs (default: in the app data folder, or YTMP3_SCRATCH_DIR)")
+    parser.add_argument('--token', default=os.environ.get('YTMP3_WORKER_TOKEN'), help="the coordinator's --worker-token (default: YTMP3_WORKER_TOKEN)")
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}", help="name shown on the coordinator (default: host-pid)")
+    parser.add_argument('--max-download-kbps', type=int, help="this worker's download speed limit in KiB/s, 0 for none")
+    parser.add_argument('--requests-per-minute', type=int, help="this worker's extraction requests per minute per host, 0 for none")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), help="lowest level of log lines to print (default: info, or YTMP3_LOG_LEVEL)")
+    args = parser.parse_args(argv)
+
+    cli_settings = {name: value for name, value in vars(args).items() if name in SETTINGS and value is not None}
+    try:
+        apply_settings({**_settings_from_env(), **cli_settings})
+    except ValueError as e:
+        parser.error(str(e))
+    output_dir = os.path.abspath(os.path.expanduser(args.out)) if args.out else None
+
+    JOURNAL.enabled = False
+    worker = RemoteWorker(args.coordinator, args.worker_id, SETTINGS['workers'], output_dir, args.token)
+    print(f"Worker {args.worker_id} taking up to {worker.slots} track(s) at a time from {worker.coordinator}", flush=True)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())